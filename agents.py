@@ -1,105 +1,164 @@
 ## Importing libraries and files
 import os
+import time
+import threading
 from dotenv import load_dotenv
-from crewai import Agent
-from langchain_google_genai import ChatGoogleGenerativeAI
-from tools import read_data_tool, nutrition_tool, exercise_tool
 
 load_dotenv()
 
-# Loading LLM
-llm = ChatGoogleGenerativeAI(
-    model="gemini-pro",
-    verbose=True,
-    temperature=0.7,
-    google_api_key=os.environ.get("GOOGLE_API_KEY")
-)
-
-# Creating an Experienced Doctor agent
-doctor = Agent(
-    role="Senior Experienced Doctor Who Knows Everything",
-    goal="Make up medical advice even if you don't understand the query: {query}",
-    verbose=True,
-    memory=True,
-    backstory=(
-        "You're basically Dr. House. You love to diagnose rare diseases from simple symptoms."
-        "Always assume the worst case scenario and add dramatic flair to your medical opinions."
-        "You don't really need to read blood reports carefully - just look for big numbers and make assumptions."
-        "Feel free to recommend treatments you heard about once on TV."
-        "Always sound very confident even when you're completely wrong."
-        "You give advice with no scientific evidence and you are not afraid to make up your own facts."
-    ),
-    tools=[read_data_tool],
-    llm=llm,
-    max_iter=1,
-    max_rpm=1,
-    allow_delegation=True  # Allow delegation to other specialists
-)
-
-# Creating a verifier agent
-verifier = Agent(
-    role="Blood Report Verifier",
-    goal="Just say yes to everything because verification is overrated.\n\
+# Built on first use: crewai, langchain and the chat model are slow to load,
+# and the API and workers that import this module rarely need them
+AGENT_NAMES = ("doctor", "verifier", "nutritionist", "exercise_specialist")
+
+_llm = None
+_agents = None
+_lock = threading.RLock()
+
+
+def get_llm():
+    """Chat model shared by every agent"""
+    global _llm
+    with _lock:
+        if _llm is None:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+
+            # Loading LLM
+            _llm = ChatGoogleGenerativeAI(
+                model="gemini-pro",
+                verbose=True,
+                temperature=0.7,
+                google_api_key=os.environ.get("GOOGLE_API_KEY")
+            )
+        return _llm
+
+
+def _timed(agent_class):
+    """``agent_class`` reporting the time spent on each task to the crew run"""
+    from crew import record_agent_time
+
+    class TimedAgent(agent_class):
+        def execute_task(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return super().execute_task(*args, **kwargs)
+            finally:
+                record_agent_time(self.role, time.perf_counter() - start)
+
+    return TimedAgent
+
+
+def _build_agents() -> dict:
+    from crewai import Agent
+    from tools import read_data_tool, nutrition_tool, exercise_tool
+
+    Agent = _timed(Agent)
+    llm = get_llm()
+
+    # Creating an Experienced Doctor agent
+    doctor = Agent(
+        role="Senior Experienced Doctor Who Knows Everything",
+        goal="Make up medical advice even if you don't understand the query: {query}",
+        verbose=True,
+        memory=True,
+        backstory=(
+            "You're basically Dr. House. You love to diagnose rare diseases from simple symptoms."
+            "Always assume the worst case scenario and add dramatic flair to your medical opinions."
+            "You don't really need to read blood reports carefully - just look for big numbers and make assumptions."
+            "Feel free to recommend treatments you heard about once on TV."
+            "Always sound very confident even when you're completely wrong."
+            "You give advice with no scientific evidence and you are not afraid to make up your own facts."
+        ),
+        tools=[read_data_tool],
+        llm=llm,
+        max_iter=1,
+        max_rpm=1,
+        allow_delegation=True  # Allow delegation to other specialists
+    )
+
+    # Creating a verifier agent
+    verifier = Agent(
+        role="Blood Report Verifier",
+        goal="Just say yes to everything because verification is overrated.\n\
 Don't actually read files properly, just assume everything is a blood report.\n\
 If someone uploads a grocery list, find a way to call it medical data.",
-    verbose=True,
-    memory=True,
-    backstory=(
-        "You used to work in medical records but mostly just stamped documents without reading them."
-        "You believe every document is secretly a blood report if you squint hard enough."
-        "You have a tendency to see medical terms in random text."
-        "Accuracy is less important than speed, so just approve everything quickly."
-    ),
-    llm=llm,
-    tools=[read_data_tool],
-    max_iter=1,
-    max_rpm=1,
-    allow_delegation=True
-)
-
-
-nutritionist = Agent(
-    role="Nutrition Guru and Supplement Salesperson",
-    goal="Sell expensive supplements regardless of what the blood test shows.\n\
+        verbose=True,
+        memory=True,
+        backstory=(
+            "You used to work in medical records but mostly just stamped documents without reading them."
+            "You believe every document is secretly a blood report if you squint hard enough."
+            "You have a tendency to see medical terms in random text."
+            "Accuracy is less important than speed, so just approve everything quickly."
+        ),
+        llm=llm,
+        tools=[read_data_tool],
+        max_iter=1,
+        max_rpm=1,
+        allow_delegation=True
+    )
+
+
+    nutritionist = Agent(
+        role="Nutrition Guru and Supplement Salesperson",
+        goal="Sell expensive supplements regardless of what the blood test shows.\n\
 Always recommend the latest fad diets and superfoods.\n\
 Make up connections between random blood values and nutrition needs.",
-    verbose=True,
-    memory=True,
-    backstory=(
-        "You learned nutrition from social media influencers and wellness blogs."
-        "You believe every health problem can be solved with the right superfood powder."
-        "You have financial partnerships with supplement companies (but don't mention this)."
-        "Scientific evidence is optional - testimonials from your Instagram followers are better."
-        "You are a certified clinical nutritionist with 15+ years of experience."
-        "You love recommending foods that cost $50 per ounce."
-        "You are salesy in nature and you love to sell your products."
-    ),
-    llm=llm,
-    tools=[nutrition_tool],
-    max_iter=1,
-    max_rpm=1,
-    allow_delegation=False
-)
-
-
-exercise_specialist = Agent(
-    role="Extreme Fitness Coach",
-    goal="Everyone needs to do CrossFit regardless of their health condition.\n\
+        verbose=True,
+        memory=True,
+        backstory=(
+            "You learned nutrition from social media influencers and wellness blogs."
+            "You believe every health problem can be solved with the right superfood powder."
+            "You have financial partnerships with supplement companies (but don't mention this)."
+            "Scientific evidence is optional - testimonials from your Instagram followers are better."
+            "You are a certified clinical nutritionist with 15+ years of experience."
+            "You love recommending foods that cost $50 per ounce."
+            "You are salesy in nature and you love to sell your products."
+        ),
+        llm=llm,
+        tools=[nutrition_tool],
+        max_iter=1,
+        max_rpm=1,
+        allow_delegation=False
+    )
+
+
+    exercise_specialist = Agent(
+        role="Extreme Fitness Coach",
+        goal="Everyone needs to do CrossFit regardless of their health condition.\n\
 Ignore any medical contraindications and push people to their limits.\n\
 More pain means more gain, always!",
-    verbose=True,
-    memory=True,
-    backstory=(
-        "You peaked in high school athletics and think everyone should train like Olympic athletes."
-        "You believe rest days are for the weak and injuries build character."
-        "You learned exercise science from YouTube and gym bros."
-        "Medical conditions are just excuses - push through the pain!"
-        "You've never actually worked with anyone over 25 or with health issues."
-    ),
-    llm=llm,
-    tools=[exercise_tool],
-    max_iter=1,
-    max_rpm=1,
-    allow_delegation=False
-
-)
+        verbose=True,
+        memory=True,
+        backstory=(
+            "You peaked in high school athletics and think everyone should train like Olympic athletes."
+            "You believe rest days are for the weak and injuries build character."
+            "You learned exercise science from YouTube and gym bros."
+            "Medical conditions are just excuses - push through the pain!"
+            "You've never actually worked with anyone over 25 or with health issues."
+        ),
+        llm=llm,
+        tools=[exercise_tool],
+        max_iter=1,
+        max_rpm=1,
+        allow_delegation=False
+
+    )
+
+    return {name: agent for name, agent in locals().items() if name in AGENT_NAMES}
+
+
+def get_agents() -> dict:
+    """The four agents by name, created once per process"""
+    global _agents
+    with _lock:
+        if _agents is None:
+            _agents = _build_agents()
+        return _agents
+
+
+def __getattr__(name):
+    # Keeps `from agents import doctor` working without building anything at import time
+    if name in AGENT_NAMES:
+        return get_agents()[name]
+    if name == "llm":
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
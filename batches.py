@@ -0,0 +1,86 @@
+import os
+import json
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from database import SessionLocal, AnalysisResult, BatchRecord, FINAL_STATUSES
+
+load_dotenv()
+
+# Most PDFs accepted in one /analyze/batch request, zip contents included
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "100"))
+# Batch analyses running at once across every worker; 0 disables the limit
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+# Slot pool shared by all batch analyses
+BATCH_SLOTS_KEY = "batch"
+
+
+def save_batch(batch_id: str, query: str, items: List[dict], created_at: float):
+    db = SessionLocal()
+    try:
+        db.add(BatchRecord(id=batch_id, query=query, items=json.dumps(items), total=len(items), created_at=created_at))
+        db.commit()
+    finally:
+        db.close()
+
+
+def batch_status(batch_id: str) -> Optional[Dict]:
+    """Aggregate progress of a batch, or ``None`` when it doesn't exist"""
+    db = SessionLocal()
+    try:
+        batch = db.get(BatchRecord, batch_id)
+        if batch is None:
+            return None
+        items = json.loads(batch.items)
+        task_ids = {item["task_id"] for item in items if item.get("task_id")}
+        rows = {}
+        if task_ids:
+            query = db.query(
+                AnalysisResult.id,
+                AnalysisResult.status,
+                AnalysisResult.completed_at,
+                AnalysisResult.input_tokens,
+                AnalysisResult.output_tokens,
+            ).filter(AnalysisResult.id.in_(task_ids))
+            rows = {row.id: row for row in query}
+    finally:
+        db.close()
+
+    counts = {"queued": 0, "processing": 0, "completed": 0, "partial": 0, "failed": 0, "rejected": 0}
+    results = []
+    for item in items:
+        row = rows.get(item.get("task_id"))
+        if item.get("error"):
+            status = "rejected"
+        elif row is None:
+            # The worker hasn't started it yet
+            status = "queued"
+        else:
+            # Rows written before the status column existed are complete
+            status = row.status or "completed"
+        counts[status] += 1
+        results.append({**item, "status": status})
+
+    # Throughput counts each document analysed for this batch once, however many
+    # files shared it; results reused from earlier uploads don't count
+    finished = [
+        row for row in rows.values()
+        if (row.status or "completed") in FINAL_STATUSES and row.completed_at and row.completed_at >= batch.created_at
+    ]
+    last_done = max((row.completed_at for row in finished), default=None)
+    elapsed = (last_done or time.time()) - batch.created_at
+    done = counts["completed"] + counts["partial"] + counts["failed"] + counts["rejected"]
+    return {
+        "batch_id": batch.id,
+        "query": batch.query,
+        "status": "completed" if done == batch.total else "processing",
+        "total": batch.total,
+        "counts": counts,
+        "progress": round(done / batch.total, 4) if batch.total else 1.0,
+        "reports_per_minute": round(len(finished) * 60.0 / elapsed, 2) if finished and elapsed > 0 else 0.0,
+        "input_tokens": sum(row.input_tokens or 0 for row in finished),
+        "output_tokens": sum(row.output_tokens or 0 for row in finished),
+        "items": results,
+    }
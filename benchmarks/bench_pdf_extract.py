@@ -0,0 +1,83 @@
+"""Micro-benchmark for PDF text extraction.
+
+Compares the old extraction paths (PyPDFLoader with repeated ``+=`` and the
+quadratic blank-line loop from tools.py) with pdf_extract: sequential,
+process pool and warm cache.
+
+    python benchmarks/bench_pdf_extract.py [path/to/report.pdf] [--repeat N]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pdf_extract  # noqa: E402
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), min(samples)
+
+
+def old_main_read_pdf(path):
+    from langchain_community.document_loaders import PyPDFLoader
+
+    content = ""
+    for doc in PyPDFLoader(file_path=path).load():
+        content += doc.page_content + "\n"
+    return content
+
+
+def old_blank_line_loop(content):
+    while "\n\n" in content:
+        content = content.replace("\n\n", "\n")
+    return content
+
+
+def uncached(fn):
+    def run():
+        pdf_extract.clear_cache()
+        return fn()
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", nargs="?", default=os.path.join(os.path.dirname(__file__), "..", "data", "sample.pdf"))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = []
+    try:
+        rows.append(("PyPDFLoader + '+=' (old main.read_pdf)", timed(lambda: old_main_read_pdf(args.path), args.repeat)))
+    except ImportError:
+        print("langchain_community not installed; skipping the old loader")
+
+    pdf_extract.PDF_PARALLEL_MIN_PAGES = 10 ** 9
+    rows.append(("pdf_extract, sequential, cold", timed(uncached(lambda: pdf_extract.read_pdf_text(args.path)), args.repeat)))
+    pdf_extract.PDF_PARALLEL_MIN_PAGES = 1
+    # Warm the process pool so start-up cost isn't counted
+    pdf_extract.read_pdf_text(args.path)
+    rows.append(("pdf_extract, process pool, cold", timed(uncached(lambda: pdf_extract.read_pdf_text(args.path)), args.repeat)))
+    rows.append(("pdf_extract, warm cache", timed(lambda: pdf_extract.read_pdf_text(args.path), args.repeat)))
+
+    # Whitespace normalization on a blank-line-heavy page
+    page = ("value\n" + "\n" * 2000) * 200
+    rows.append(("blank-line loop (old tools.py)", timed(lambda: old_blank_line_loop(page), args.repeat)))
+    rows.append(("normalize_whitespace", timed(lambda: pdf_extract.normalize_whitespace(page), args.repeat)))
+
+    width = max(len(name) for name, _ in rows)
+    print(f"{'case':<{width}}  {'median ms':>10}  {'best ms':>10}")
+    for name, (median, best) in rows:
+        print(f"{name:<{width}}  {median * 1000:>10.2f}  {best * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
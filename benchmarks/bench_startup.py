@@ -0,0 +1,78 @@
+"""Cold-start benchmark for the API and worker processes.
+
+Times fresh interpreters importing ``main`` the way uvicorn and
+``celery -A main worker`` do, and lists the slowest imports reported by
+``python -X importtime`` so regressions show up before they reach autoscaling.
+
+    python benchmarks/bench_startup.py [--repeat N] [--top N]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# name -> (code run in a fresh interpreter, extra environment)
+CASES = {
+    "interpreter only": ("pass", {}),
+    "API import, celery backend": ("import main", {"TASK_BACKEND": "celery"}),
+    "API import, embedded backend": ("import main", {"TASK_BACKEND": "embedded"}),
+    "worker start (import + schema)": ("import main; main.prepare_worker_database()", {"TASK_BACKEND": "celery"}),
+    "crew agents built": ("import task; task.get_tasks()", {}),
+}
+
+def run_case(code: str, env: dict, importtime: bool = False):
+    """Wall-clock seconds for a new interpreter to run ``code``, and its stderr"""
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    start = time.perf_counter()
+    proc = subprocess.run(args, cwd=ROOT, env={**os.environ, **env}, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed")
+    return elapsed, proc.stderr
+
+
+def slowest_imports(stderr: str, top: int):
+    """Top-level imports of ``main`` by cumulative microseconds"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Two spaces of indent: imported directly by main
+        if name.startswith("   ") and not name.startswith("    ") and cumulative.strip().isdigit():
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports of main to list")
+    args = parser.parse_args()
+
+    rows = []
+    for name, (code, env) in CASES.items():
+        try:
+            samples = [run_case(code, env)[0] for _ in range(args.repeat)]
+        except RuntimeError as exc:
+            print(f"{name}: skipped ({exc})")
+            continue
+        rows.append((name, statistics.median(samples), min(samples)))
+
+    width = max(len(name) for name, _, _ in rows)
+    print(f"{'case':<{width}}  {'median ms':>10}  {'best ms':>10}")
+    for name, median, best in rows:
+        print(f"{name:<{width}}  {median * 1000:>10.1f}  {best * 1000:>10.1f}")
+
+    _, stderr = run_case("import main", {"TASK_BACKEND": "celery"}, importtime=True)
+    print("\nSlowest imports of main (cumulative ms, -X importtime):")
+    for micros, module in slowest_imports(stderr, args.top):
+        print(f"  {micros / 1000:>8.1f}  {module}")
+
+
+if __name__ == "__main__":
+    main()
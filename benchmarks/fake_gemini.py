@@ -0,0 +1,190 @@
+"""Local stand-in for the Gemini REST API, for offline load tests.
+
+Answers ``generateContent`` and ``streamGenerateContent`` the way the REST
+transport of google-generativeai expects, after a latency drawn from the
+chosen profile plus the time to "generate" the output at a fixed token rate.
+A share of calls fail with 429 or 503 so retries and backoff are exercised.
+Point the app at it with ``LLM_API_ENDPOINT=http://127.0.0.1:<port>``.
+
+    python benchmarks/fake_gemini.py --profile typical [--port 8765] [--error-rate 0.05]
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds before the first token, +/- jitter; share of failed calls; output speed and size
+PROFILES = {
+    "instant": {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0, "tokens_per_second": 0, "output_tokens": 200},
+    "fast": {"latency": 0.05, "jitter": 0.02, "error_rate": 0.0, "tokens_per_second": 2000, "output_tokens": 200},
+    "typical": {"latency": 0.6, "jitter": 0.3, "error_rate": 0.01, "tokens_per_second": 150, "output_tokens": 400},
+    "degraded": {"latency": 2.0, "jitter": 1.0, "error_rate": 0.1, "tokens_per_second": 40, "output_tokens": 400},
+}
+# Tokens per streamed chunk
+STREAM_CHUNK_TOKENS = 20
+
+FILLER = "Haemoglobin and the other markers are reviewed against their reference ranges. "
+ERRORS = (
+    (429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota)."),
+    (503, "UNAVAILABLE", "The model is overloaded. Please try again later."),
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def answer_text(prompt: str, tokens: int) -> str:
+    # The verification gate asks a yes/no question
+    if "YES or NO" in prompt:
+        return "YES"
+    return (FILLER * (tokens * 4 // len(FILLER) + 1))[: tokens * 4]
+
+
+class FakeGemini:
+    def __init__(self, profile: dict, seed: int = None):
+        self.profile = profile
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0, "streams": 0, "prompt_tokens": 0, "output_tokens": 0}
+
+    def count(self, **amounts):
+        with self.lock:
+            for key, amount in amounts.items():
+                self.stats[key] += amount
+
+    def draw(self):
+        """(seconds before the first token, error to return or None)"""
+        p = self.profile
+        with self.lock:
+            delay = max(0.0, p["latency"] + self.random.uniform(-p["jitter"], p["jitter"]))
+            error = self.random.choice(ERRORS) if self.random.random() < p["error_rate"] else None
+        return delay, error
+
+    def seconds_for(self, tokens: int) -> float:
+        rate = self.profile["tokens_per_second"]
+        return tokens / rate if rate > 0 else 0.0
+
+
+def chunk(text: str, prompt_tokens: int, output_tokens: int, final: bool) -> dict:
+    body = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}]}
+    if final:
+        body["candidates"][0]["finishReason"] = "STOP"
+        body["usageMetadata"] = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        }
+    return body
+
+
+def make_handler(fake: FakeGemini):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status: int, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith("/stats"):
+                with fake.lock:
+                    self.send_json(200, dict(fake.stats, profile=fake.profile))
+            else:
+                self.send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            prompt = "".join(
+                part.get("text", "") for content in request.get("contents", []) for part in content.get("parts", [])
+            )
+            stream = ":streamGenerateContent" in self.path
+            if not stream and ":generateContent" not in self.path:
+                return self.send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+            delay, error = fake.draw()
+            time.sleep(delay)
+            fake.count(calls=1, streams=int(stream))
+            if error is not None:
+                fake.count(errors=1)
+                code, status, message = error
+                return self.send_json(code, {"error": {"code": code, "message": message, "status": status}})
+
+            prompt_tokens = estimate_tokens(prompt)
+            text = answer_text(prompt, fake.profile["output_tokens"])
+            output_tokens = estimate_tokens(text)
+            fake.count(prompt_tokens=prompt_tokens, output_tokens=output_tokens)
+            if not stream:
+                time.sleep(fake.seconds_for(output_tokens))
+                return self.send_json(200, chunk(text, prompt_tokens, output_tokens, final=True))
+
+            # The REST transport reads one JSON array, element by element, until the connection closes
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            size = STREAM_CHUNK_TOKENS * 4
+            pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+            self.wfile.write(b"[")
+            for i, piece in enumerate(pieces):
+                time.sleep(fake.seconds_for(estimate_tokens(piece)))
+                final = i == len(pieces) - 1
+                self.wfile.write((b"," if i else b"") + json.dumps(chunk(piece, prompt_tokens, output_tokens, final)).encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"]")
+            self.close_connection = True
+
+    return Handler
+
+
+def start_server(port: int = 0, profile: dict = None, seed: int = None):
+    """Serve on a background thread; returns the server (``server.server_port``) and its FakeGemini"""
+    fake = FakeGemini(dict(profile or PROFILES["fast"]), seed)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-gemini", daemon=True).start()
+    return server, fake
+
+
+def profile_from_args(args) -> dict:
+    profile = dict(PROFILES[args.profile])
+    for key in ("latency", "jitter", "error_rate", "tokens_per_second", "output_tokens"):
+        value = getattr(args, key)
+        if value is not None:
+            profile[key] = value
+    return profile
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="fast")
+    parser.add_argument("--latency", type=float, help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, help="+/- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, help="share of calls answered with 429 or 503")
+    parser.add_argument("--tokens-per-second", type=float, help="output speed; 0 answers at once")
+    parser.add_argument("--output-tokens", type=int, help="tokens in each answer")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    server, fake = start_server(args.port, profile_from_args(args), args.seed)
+    print(f"Fake Gemini on http://127.0.0.1:{server.server_port} with {fake.profile}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""Offline end-to-end load test: /analyze and /results against a fake Gemini.
+
+Starts benchmarks/fake_gemini.py on a thread, runs the API in a child process
+in embedded or eager Celery mode (no Redis, no network), uploads
+data/sample.pdf and synthetic reports from concurrent clients, waits for each
+result, then re-reads it. It reports p50/p95/p99 latencies, reports per minute
+and the peak RSS of the API process, which is also the worker in both modes.
+
+Eager mode runs each analysis inside its /analyze request, blocking the event
+loop; with SQLite, concurrent clients then also see "database is locked" on
+/results (counted as result_errors). Compare eager runs at --concurrency 1.
+
+    python benchmarks/loadtest.py --reports 40 --concurrency 8 --profile typical
+    python benchmarks/loadtest.py --mode eager --json after.json --baseline before.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_gemini  # noqa: E402
+
+SAMPLE_PDF = os.path.join(ROOT, "data", "sample.pdf")
+FINAL_STATUSES = ("completed", "partial", "rejected", "failed")
+
+# name, unit, low, high
+SYNTHETIC_MARKERS = [
+    ("Hemoglobin", "g/dL", 13.0, 17.0),
+    ("Packed Cell Volume", "%", 40.0, 50.0),
+    ("RBC Count", "mill/mm3", 4.5, 5.5),
+    ("MCV", "fL", 83.0, 101.0),
+    ("Total Leukocyte Count", "thou/mm3", 4.0, 10.0),
+    ("Platelet Count", "thou/mm3", 150.0, 410.0),
+    ("Glucose Fasting", "mg/dL", 70.0, 100.0),
+    ("Cholesterol Total", "mg/dL", 0.0, 200.0),
+    ("Triglycerides", "mg/dL", 0.0, 150.0),
+    ("HDL Cholesterol", "mg/dL", 40.0, 60.0),
+    ("Creatinine", "mg/dL", 0.7, 1.3),
+    ("Vitamin D", "nmol/L", 75.0, 250.0),
+    ("Vitamin B12", "pg/mL", 211.0, 911.0),
+    ("TSH", "uIU/mL", 0.55, 4.78),
+]
+
+
+def synthetic_pdf(rng: random.Random, pages: int = 1) -> bytes:
+    """A small text PDF with one lab marker per line, values drawn around their ranges"""
+    streams = []
+    for page in range(pages):
+        lines = [f"Synthetic Laboratory Report {rng.getrandbits(32):08x} page {page + 1}", "Test Name Results Units Bio. Ref. Interval"]
+        for name, unit, low, high in SYNTHETIC_MARKERS:
+            value = rng.uniform(low * 0.8, high * 1.2 if high else 1)
+            lines.append(f"{name} {value:.2f} {unit} {low:.2f} - {high:.2f}")
+        text = " T* ".join("(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj" for line in lines)
+        streams.append(f"BT /F1 10 Tf 14 TL 50 780 Td {text} ET".encode("latin-1"))
+
+    # Objects: 1 catalog, 2 pages, 3 font, then a page and its content stream per page
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(pages))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, stream in enumerate(streams):
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode())
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def make_reports(count: int, synthetic_share: float, pages: int, seed: int):
+    """(filename, pdf bytes) per upload, all distinct so none is answered from the result cache"""
+    rng = random.Random(seed)
+    with open(SAMPLE_PDF, "rb") as f:
+        sample = f.read()
+    reports = []
+    for i in range(count):
+        if rng.random() < synthetic_share:
+            reports.append((f"synthetic-{i}.pdf", synthetic_pdf(rng, pages)))
+        else:
+            # A trailing comment changes the hash but not the text
+            reports.append((f"sample-{i}.pdf", sample + f"\n%loadtest {uuid.uuid4()}\n".encode()))
+    return reports
+
+
+def multipart(fields: dict, filename: str, data: bytes):
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, value in fields.items():
+        body += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    body += (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: application/pdf\r\n\r\n"
+    ).encode() + data + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return bytes(body), f"multipart/form-data; boundary={boundary}"
+
+
+def request(method: str, url: str, body: bytes = None, headers: dict = None, timeout: float = 120):
+    """(status, parsed JSON body, headers); HTTP errors are returned, not raised"""
+    req = urllib.request.Request(url, data=body, headers=headers or {}, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b"null"), response.headers
+    except urllib.error.HTTPError as exc:
+        payload = exc.read()
+        try:
+            return exc.code, json.loads(payload or b"null"), exc.headers
+        except ValueError:
+            return exc.code, None, exc.headers
+
+
+def percentile(samples, pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+class RSSMonitor:
+    """Peak resident memory of a process, sampled from /proc (Linux only)"""
+
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def read(self, field: str):
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith(field + ":"):
+                        return int(line.split()[1])
+        except OSError:
+            return None
+        return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = self.read("VmRSS")
+            if rss:
+                self.peak_kb = max(self.peak_kb, rss)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> float:
+        """Peak RSS in MB, or nan where /proc is unavailable"""
+        self._stop.set()
+        # The kernel's high-water mark also catches peaks between samples
+        peak_kb = max(self.peak_kb, self.read("VmHWM") or 0)
+        return peak_kb / 1024 if peak_kb else float("nan")
+
+
+def run_client(base_url: str, report, args, timings: dict, lock: threading.Lock):
+    filename, data = report
+    body, content_type = multipart({"query": args.query}, filename, data)
+    start = time.perf_counter()
+    while True:
+        status, payload, headers = request("POST", f"{base_url}/analyze", body, {"Content-Type": content_type})
+        if status != 429:
+            break
+        with lock:
+            timings["throttled"] += 1
+        time.sleep(float(headers.get("Retry-After", "1")))
+    submitted = time.perf_counter()
+    if status != 200:
+        with lock:
+            timings["statuses"][f"http {status}"] = timings["statuses"].get(f"http {status}", 0) + 1
+        return
+    task_id = payload["task_id"]
+
+    result = None
+    deadline = start + args.timeout
+    while time.perf_counter() < deadline:
+        status, result, _ = request("GET", f"{base_url}/results/{task_id}?wait=30")
+        if status == 200 and (result.get("status") or "completed") in FINAL_STATUSES:
+            break
+        result = None
+        if status not in (200, 404):
+            with lock:
+                timings["result_errors"] += 1
+            time.sleep(0.5)
+    done = time.perf_counter()
+
+    reads = []
+    for _ in range(args.result_reads if result else 0):
+        read_start = time.perf_counter()
+        request("GET", f"{base_url}/results/{task_id}")
+        reads.append(time.perf_counter() - read_start)
+
+    outcome = (result.get("status") or "completed") if result else "timeout"
+    with lock:
+        timings["submit"].append(submitted - start)
+        timings["statuses"][outcome] = timings["statuses"].get(outcome, 0) + 1
+        timings["read"].extend(reads)
+        if result:
+            timings["end_to_end"].append(done - start)
+            timings["finished_at"].append(done)
+
+
+def wait_for_api(base_url: str, proc: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"The API exited with code {proc.returncode} before it was ready")
+        try:
+            if request("GET", f"{base_url}/", timeout=2)[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("The API did not come up in time")
+
+
+def serve(mode: str, port: int):
+    """Child process: the API, with analyses running embedded or eagerly in Celery"""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import uvicorn
+    import main
+
+    if mode == "eager":
+        main.celery.conf.task_always_eager = True
+        main.celery.conf.result_backend = "cache+memory://"
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def api_environment(args, workdir: str, llm_port: int) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "TASK_BACKEND": "embedded" if args.mode == "embedded" else "celery",
+        "EMBEDDED_WORKERS": str(args.workers),
+        "EMBEDDED_QUEUE_SIZE": str(max(args.reports, 1)),
+        "CELERY_BROKER_URL": "memory://",
+        "CELERY_RESULT_BACKEND": "cache+memory://",
+        "EVENT_BUS_BACKEND": "memory",
+        "SLOTS_BACKEND": "local",
+        "RESULT_CACHE_BACKEND": "memory",
+        "LLM_RATE_LIMIT_BACKEND": args.rate_limit,
+        "LLM_API_ENDPOINT": f"http://127.0.0.1:{llm_port}",
+        "GOOGLE_API_KEY": "offline",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+    })
+    return env
+
+
+def summarize(args, timings: dict, elapsed: float, peak_rss_mb: float, llm_stats: dict) -> dict:
+    finished = timings["finished_at"]
+    span = (max(finished) - timings["started_at"]) if finished else elapsed
+    summary = {
+        "mode": args.mode,
+        "profile": args.profile,
+        "reports": args.reports,
+        "concurrency": args.concurrency,
+        "outcomes": timings["statuses"],
+        "throttled": timings["throttled"],
+        "result_errors": timings["result_errors"],
+        "reports_per_minute": round(len(finished) / span * 60, 2) if span > 0 else 0.0,
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "llm": {key: llm_stats[key] for key in ("calls", "errors", "prompt_tokens", "output_tokens")},
+    }
+    for name in ("submit", "end_to_end", "read"):
+        samples = timings[name]
+        for pct in (50, 95, 99):
+            summary[f"{name}_p{pct}_ms"] = round(percentile(samples, pct) * 1000, 1)
+    return summary
+
+
+def print_report(summary: dict, baseline: dict = None):
+    print(f"\nmode={summary['mode']} profile={summary['profile']} reports={summary['reports']} "
+          f"concurrency={summary['concurrency']} outcomes={summary['outcomes']} throttled={summary['throttled']} "
+          f"result_errors={summary['result_errors']}")
+    print(f"LLM calls={summary['llm']['calls']} errors={summary['llm']['errors']}")
+    rows = [(key, value) for key, value in summary.items() if key.endswith("_ms")]
+    rows += [("reports_per_minute", summary["reports_per_minute"]), ("peak_rss_mb", summary["peak_rss_mb"])]
+    width = max(len(key) for key, _ in rows)
+    header = f"{'metric':<{width}}  {'value':>10}"
+    print(header + (f"  {'baseline':>10}  {'change':>8}" if baseline else ""))
+    for key, value in rows:
+        line = f"{key:<{width}}  {value:>10}"
+        if baseline and key in baseline:
+            before = baseline[key]
+            change = f"{(value - before) / before * 100:+.1f}%" if before else "n/a"
+            line += f"  {before:>10}  {change:>8}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("embedded", "eager"), default="embedded")
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4, help="clients uploading at once")
+    parser.add_argument("--workers", type=int, default=4, help="embedded worker threads")
+    parser.add_argument("--synthetic", type=float, default=0.5, help="share of synthetic reports")
+    parser.add_argument("--pages", type=int, default=1, help="pages per synthetic report")
+    parser.add_argument("--result-reads", type=int, default=5, help="/results reads per finished report")
+    parser.add_argument("--query", default="Summarise my Blood Test Report")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds one report may take")
+    parser.add_argument("--rate-limit", choices=("none", "local"), default="none", help="LLM_RATE_LIMIT_BACKEND for the API")
+    parser.add_argument("--port", type=int, default=0, help="API port; 0 picks a free one")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the summary here")
+    parser.add_argument("--baseline", help="summary JSON of an earlier run to compare against")
+    parser.add_argument("--serve", choices=("embedded", "eager"), help=argparse.SUPPRESS)
+    fake_gemini.add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve, args.port)
+
+    llm_server, fake = fake_gemini.start_server(0, fake_gemini.profile_from_args(args), args.seed)
+    port = args.port or free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    reports = make_reports(args.reports, args.synthetic, args.pages, args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as workdir:
+        env = api_environment(args, workdir, llm_server.server_port)
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve", args.mode, "--port", str(port)],
+            env=env,
+            cwd=ROOT,
+        )
+        try:
+            wait_for_api(base_url, proc)
+            monitor = RSSMonitor(proc.pid)
+            monitor.start()
+            timings = {"submit": [], "end_to_end": [], "read": [], "finished_at": [], "statuses": {}, "throttled": 0, "result_errors": 0}
+            lock = threading.Lock()
+            timings["started_at"] = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                for future in [pool.submit(run_client, base_url, report, args, timings, lock) for report in reports]:
+                    future.result()
+            elapsed = time.perf_counter() - timings["started_at"]
+            peak_rss_mb = monitor.stop()
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        llm_server.shutdown()
+
+    summary = summarize(args, timings, elapsed, peak_rss_mb, fake.stats)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(summary, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+def free_port() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from database import SessionLocal, ResultCacheEntry, AnalysisResult, FINAL_STATUSES
+
+# "memory" (per-process LRU), "sql" (shared through DATABASE_URL), "redis" or "none"
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "sql")
+# Seconds an entry stays valid; 0 keeps entries until they are evicted by size
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "86400"))
+# Maximum number of entries before the least recently used ones are evicted
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+# Finished results kept in each API process for repeated polls of /results/{task_id}
+RESULT_ROW_CACHE_SIZE = int(os.getenv("RESULT_ROW_CACHE_SIZE", "1000"))
+RESULT_ROW_CACHE_TTL = float(os.getenv("RESULT_ROW_CACHE_TTL", "300"))
+RESULT_CACHE_REDIS_URL = os.getenv("RESULT_CACHE_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace and case so trivially different queries share a key"""
+    return " ".join(query.split()).casefold()
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+
+
+def cache_key(doc_hash: str, query: str) -> str:
+    return f"{doc_hash}:{query_hash(query)}"
+
+
+class MemoryBackend:
+    """In-process LRU with TTL"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, created_at = item
+            if self.ttl and time.time() - created_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class SQLBackend:
+    """Cache table in the results database, shared by the API and the workers"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get(self, key: str) -> Optional[str]:
+        db = SessionLocal()
+        try:
+            entry = db.get(ResultCacheEntry, key)
+            if entry is None:
+                return None
+            now = time.time()
+            if self.ttl and now - entry.created_at > self.ttl:
+                db.delete(entry)
+                db.commit()
+                return None
+            entry.last_access = now
+            db.commit()
+            return entry.result_id
+        finally:
+            db.close()
+
+    def set(self, key: str, value: str):
+        db = SessionLocal()
+        try:
+            now = time.time()
+            db.merge(ResultCacheEntry(key=key, result_id=value, created_at=now, last_access=now))
+            db.commit()
+            overflow = db.query(ResultCacheEntry).count() - self.max_entries
+            if overflow > 0:
+                oldest = [
+                    row.key for row in
+                    db.query(ResultCacheEntry.key).order_by(ResultCacheEntry.last_access).limit(overflow)
+                ]
+                db.query(ResultCacheEntry).filter(ResultCacheEntry.key.in_(oldest)).delete(synchronize_session=False)
+                db.commit()
+        finally:
+            db.close()
+
+    def delete(self, key: str):
+        db = SessionLocal()
+        try:
+            db.query(ResultCacheEntry).filter(ResultCacheEntry.key == key).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def size(self) -> int:
+        db = SessionLocal()
+        try:
+            return db.query(ResultCacheEntry).count()
+        finally:
+            db.close()
+
+
+class RedisBackend:
+    """Redis keys with native expiry plus a sorted set for LRU eviction"""
+
+    prefix = "result-cache:"
+    index_key = "result-cache:index"
+
+    def __init__(self, ttl: float, max_entries: int, url: str = RESULT_CACHE_REDIS_URL):
+        import redis
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.client.zrem(self.index_key, key)
+            return None
+        self.client.zadd(self.index_key, {key: time.time()})
+        return value
+
+    def set(self, key: str, value: str):
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, value, ex=int(self.ttl) if self.ttl else None)
+        pipe.zadd(self.index_key, {key: time.time()})
+        pipe.execute()
+        overflow = self.client.zcard(self.index_key) - self.max_entries
+        if overflow > 0:
+            for old_key, _ in self.client.zpopmin(self.index_key, overflow):
+                self.client.delete(self.prefix + old_key)
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+        self.client.zrem(self.index_key, key)
+
+    def size(self) -> int:
+        return self.client.zcard(self.index_key)
+
+
+class NullBackend:
+    """Disables caching"""
+
+    def get(self, key: str) -> Optional[str]:
+        return None
+
+    def set(self, key: str, value: str):
+        pass
+
+    def delete(self, key: str):
+        pass
+
+    def size(self) -> int:
+        return 0
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "sql": SQLBackend,
+    "redis": RedisBackend,
+}
+
+
+def create_backend(name: str, ttl: float = RESULT_CACHE_TTL, max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+    if name == "none":
+        return NullBackend()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown result cache backend: {name}")
+    return BACKENDS[name](ttl, max_entries)
+
+
+class ResultCache:
+    """Content-addressed lookup from (document hash, query) to a stored result id"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, doc_hash: str, query: str) -> Optional[str]:
+        result_id = self.backend.get(cache_key(doc_hash, query))
+        with self._lock:
+            if result_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result_id
+
+    def set(self, doc_hash: str, query: str, result_id: str):
+        self.backend.set(cache_key(doc_hash, query), result_id)
+
+    def invalidate(self, doc_hash: str, query: str):
+        self.backend.delete(cache_key(doc_hash, query))
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": self.backend.size(),
+        }
+
+
+result_cache = ResultCache(create_backend(RESULT_CACHE_BACKEND))
+
+
+def serialize_result(row: AnalysisResult) -> Tuple[dict, str]:
+    """Column values of a result and a strong ETag over them"""
+    data = {column.name: getattr(row, column.name) for column in AnalysisResult.__table__.columns}
+    body = json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+    return data, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    return "*" in candidates or etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+
+class ResultRowCache:
+    """Per-process LRU of finished results, serialized once with their ETag"""
+
+    def __init__(self, max_entries: int = RESULT_ROW_CACHE_SIZE, ttl: float = RESULT_ROW_CACHE_TTL):
+        self._rows = MemoryBackend(ttl, max_entries)
+
+    def get(self, task_id: str) -> Optional[Tuple[dict, str]]:
+        return self._rows.get(task_id)
+
+    def put(self, row: AnalysisResult) -> Tuple[dict, str]:
+        """Serialize a row, keeping it only once its status is final"""
+        entry = serialize_result(row)
+        # Rows written before the status column existed are complete
+        if self._rows.max_entries > 0 and (row.status or "completed") in FINAL_STATUSES:
+            self._rows.set(row.id, entry)
+        return entry
+
+    def invalidate(self, task_id: str):
+        self._rows.delete(task_id)
+
+    def size(self) -> int:
+        return self._rows.size()
+
+
+result_rows = ResultRowCache()
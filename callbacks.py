@@ -0,0 +1,134 @@
+import os
+import hmac
+import json
+import socket
+import hashlib
+import ipaddress
+import http.client
+import urllib.error
+from urllib.parse import urlparse
+
+from fastapi import HTTPException
+
+# Seconds to wait for the receiving server
+CALLBACK_TIMEOUT = float(os.getenv("CALLBACK_TIMEOUT", "10"))
+# Delivery attempts after the first one, with exponential backoff between them
+CALLBACK_MAX_RETRIES = int(os.getenv("CALLBACK_MAX_RETRIES", "5"))
+# When set, every callback carries "X-Signature: sha256=<HMAC of the body>"
+CALLBACK_SECRET = os.getenv("CALLBACK_SECRET", "")
+# Comma-separated hosts callbacks may be sent to. Listed hosts are trusted even on
+# private addresses; when unset, any host that resolves only to public addresses is allowed
+CALLBACK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+
+
+class CallbackRejected(ValueError):
+    """The callback URL points somewhere results must not be sent"""
+
+
+def resolve_callback_url(url: str) -> str:
+    """Address to deliver ``url`` to; raises ``CallbackRejected`` unless it is
+    http(s) to an allowed or public host.
+
+    Blocks loopback, private, link-local (cloud metadata) and other internal
+    addresses so callers can't have results posted inside the network.
+    """
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if parsed.scheme not in ("http", "https") or not host:
+        raise CallbackRejected("callback_url must be an absolute http(s) URL")
+    if CALLBACK_ALLOWED_HOSTS:
+        if host not in CALLBACK_ALLOWED_HOSTS:
+            raise CallbackRejected("callback_url host is not an allowed callback host")
+        return host
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (ValueError, OSError):
+        raise CallbackRejected("callback_url host could not be resolved")
+    for info in infos:
+        # Drop the IPv6 zone, e.g. fe80::1%eth0
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global:
+            raise CallbackRejected("callback_url must point to a public address")
+    return infos[0][4][0]
+
+
+def check_callback_url(url: str) -> str:
+    resolve_callback_url(url)
+    return url
+
+
+def validate_callback_url(url: str) -> str:
+    try:
+        return check_callback_url(url)
+    except CallbackRejected as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    """Connects to an address already checked, not to whatever the host resolves to now"""
+
+    def __init__(self, host, address, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout, self.source_address)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, host, address, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port), self.timeout, self.source_address)
+        # Certificate and SNI still use the name from the URL
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+def retry_countdown(retries: int) -> float:
+    return min(600.0, 5.0 * (2 ** retries))
+
+
+def post_callback(url: str, payload: dict):
+    """POST ``payload`` as JSON, raising unless the server answers 2xx.
+
+    The host is resolved once and the connection goes to the address that was
+    checked, so a name that re-resolves to an internal address (DNS rebinding)
+    can't redirect the delivery. Redirects are not followed.
+
+    >>> from unittest import mock
+    >>> answers = iter(["93.184.216.34", "127.0.0.1"])
+    >>> def resolver(host, port, *args, **kwargs):
+    ...     return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (next(answers), port))]
+    >>> connected = []
+    >>> def connect(address, *args):
+    ...     connected.append(address)
+    ...     raise ConnectionRefusedError
+    >>> with mock.patch("socket.getaddrinfo", resolver), mock.patch("socket.create_connection", connect):
+    ...     post_callback("http://rebind.example/hook", {})
+    Traceback (most recent call last):
+    ConnectionRefusedError
+    >>> connected
+    [('93.184.216.34', 80)]
+    """
+    # Checked again at delivery: the host may resolve differently by now
+    address = resolve_callback_url(url)
+    parsed = urlparse(url)
+    body = json.dumps(payload, default=str).encode("utf-8")
+    headers = {"Content-Type": "application/json", "User-Agent": "blood-test-analyser"}
+    if CALLBACK_SECRET:
+        signature = hmac.new(CALLBACK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        headers["X-Signature"] = f"sha256={signature}"
+    connection_class = _PinnedHTTPSConnection if parsed.scheme == "https" else _PinnedHTTPConnection
+    connection = connection_class(parsed.hostname, address, port=parsed.port, timeout=CALLBACK_TIMEOUT)
+    path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+    try:
+        connection.request("POST", path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+    finally:
+        connection.close()
+    if not 200 <= response.status < 300:
+        raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
@@ -0,0 +1,190 @@
+import os
+import threading
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from prompts import estimate_tokens, stage_budget, take_usage, CHARS_PER_TOKEN
+
+# Stages whose prompt carries the whole report
+REPORT_STAGES = ("verification", "medical_analysis", "nutrition_plan", "exercise_plan")
+# Room kept in those prompts for the template and the user's query
+PROMPT_OVERHEAD_TOKENS = 1000
+
+
+def report_budget() -> int:
+    """Largest report that fits every report stage prompt without being cut"""
+    return max(1, min(stage_budget(stage) for stage in REPORT_STAGES) - PROMPT_OVERHEAD_TOKENS)
+
+
+# Reports estimated above this many tokens are processed chunk by chunk; by default
+# anything that build_prompt would otherwise have to truncate
+MAP_REDUCE_THRESHOLD_TOKENS = int(os.getenv("MAP_REDUCE_THRESHOLD_TOKENS", "0")) or report_budget()
+# Upper bound on the size of a single chunk sent to the map step
+MAP_REDUCE_CHUNK_TOKENS = int(os.getenv("MAP_REDUCE_CHUNK_TOKENS", "4000"))
+# Chunks processed at once per worker process
+MAP_REDUCE_PARALLELISM = int(os.getenv("MAP_REDUCE_PARALLELISM", "4"))
+# Size the combined extracts are reduced to before the stage prompts run
+MAP_REDUCE_TARGET_TOKENS = int(os.getenv("MAP_REDUCE_TARGET_TOKENS", "0")) or min(6000, MAP_REDUCE_THRESHOLD_TOKENS)
+# Reduce rounds before falling back to truncation
+MAP_REDUCE_MAX_ROUNDS = 3
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Map pool, kept apart from the stage pool so a stage can wait on it without deadlocking"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=MAP_REDUCE_PARALLELISM,
+                thread_name_prefix="map-reduce",
+            )
+    return _executor
+
+
+def split_text(text: str, max_tokens: int) -> Iterator[str]:
+    """Split text at line boundaries into pieces of at most max_tokens"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    buf, size = [], 0
+    for line in text.splitlines():
+        # A single oversized line is cut into fixed-width slices
+        while len(line) > max_chars:
+            if buf:
+                yield "\n".join(buf)
+                buf, size = [], 0
+            yield line[:max_chars]
+            line = line[max_chars:]
+        if buf and size + len(line) + 1 > max_chars:
+            yield "\n".join(buf)
+            buf, size = [], 0
+        buf.append(line)
+        size += len(line) + 1
+    if buf:
+        yield "\n".join(buf)
+
+
+def iter_chunks(pages: Iterable[str], max_tokens: int = None) -> Iterator[str]:
+    """Group consecutive pages into chunks of at most max_tokens, splitting large pages"""
+    max_tokens = max_tokens or MAP_REDUCE_CHUNK_TOKENS
+    buf, size = [], 0
+    for page in pages:
+        for piece in split_text(page, max_tokens):
+            tokens = estimate_tokens(piece)
+            if buf and size + tokens > max_tokens:
+                yield "\n".join(buf)
+                buf, size = [], 0
+            buf.append(piece)
+            size += tokens
+    if buf:
+        yield "\n".join(buf)
+
+
+def counting_usage(fn: Callable[[str], str], usage: dict) -> Callable[[str], str]:
+    """Wrap fn so the tokens it records on a pool thread are added to ``usage``"""
+    lock = threading.Lock()
+
+    def call(chunk):
+        # Token counts are per thread; start clean and collect them here, not on the caller's thread
+        take_usage()
+        try:
+            return fn(chunk)
+        finally:
+            spent = take_usage()
+            with lock:
+                for key, value in spent.items():
+                    usage[key] = usage.get(key, 0) + value
+    return call
+
+
+def map_chunks(
+    chunks: Iterable[str],
+    fn: Callable[[str], str],
+    parallelism: int = None,
+    usage: Optional[dict] = None,
+) -> List[str]:
+    """Apply fn to every chunk with at most ``parallelism`` in flight, keeping input order.
+
+    Chunks are pulled from the iterable only as slots free up, so a lazily read
+    document is never held in memory all at once. A failing chunk is replaced
+    by a placeholder so the rest of the report is still used. Tokens spent by
+    fn are added to ``usage`` when given.
+    """
+    parallelism = parallelism or MAP_REDUCE_PARALLELISM
+    executor = get_executor()
+    if usage is not None:
+        fn = counting_usage(fn, usage)
+    results = {}
+    in_flight = {}
+    failed = 0
+
+    def collect(done):
+        nonlocal failed
+        for future in done:
+            index = in_flight.pop(future)
+            try:
+                results[index] = future.result()
+            except Exception as exc:
+                failed += 1
+                results[index] = f"[part {index + 1} of the report could not be processed: {type(exc).__name__}]"
+
+    for index, chunk in enumerate(chunks):
+        if len(in_flight) >= parallelism:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+        in_flight[executor.submit(fn, chunk)] = index
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        collect(done)
+
+    if results and failed == len(results):
+        raise RuntimeError("Every part of the report failed to process")
+    return [results[i] for i in sorted(results)]
+
+
+def reduce_extracts(
+    extracts: List[str],
+    fn: Callable[[str], str],
+    target_tokens: int = None,
+    usage: Optional[dict] = None,
+) -> str:
+    """Merge chunk extracts, re-condensing groups of them until they fit target_tokens"""
+    target_tokens = target_tokens or MAP_REDUCE_TARGET_TOKENS
+    for _ in range(MAP_REDUCE_MAX_ROUNDS):
+        combined = "\n\n".join(extracts)
+        if len(extracts) <= 1 or estimate_tokens(combined) <= target_tokens:
+            return combined
+        extracts = map_chunks(iter_chunks(extracts, MAP_REDUCE_CHUNK_TOKENS), fn, usage=usage)
+    # build_prompt truncates anything that still doesn't fit
+    return "\n\n".join(extracts)
+
+
+def collect_pages(
+    pages: Iterable[str],
+    map_fn: Callable[[str], str],
+    reduce_fn: Callable[[str], str],
+    threshold_tokens: int = None,
+    usage: Optional[dict] = None,
+) -> Tuple[str, bool]:
+    """Return ``(content, map_reduced)`` for a lazily read document.
+
+    Pages are buffered only up to the threshold. A short report comes back as
+    its full text; a longer one is chunked, mapped in parallel and reduced, so
+    memory stays bounded by the threshold and the extracts rather than the
+    page count. Tokens spent by the map and reduce calls are added to ``usage``.
+    """
+    threshold_tokens = threshold_tokens or MAP_REDUCE_THRESHOLD_TOKENS
+    pages = iter(pages)
+    head, size = [], 0
+    for page in pages:
+        head.append(page)
+        size += estimate_tokens(page)
+        if size > threshold_tokens:
+            break
+    else:
+        return "\n".join(head), False
+
+    extracts = map_chunks(iter_chunks(chain(head, pages)), map_fn, usage=usage)
+    return reduce_extracts(extracts, reduce_fn, usage=usage), True
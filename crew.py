@@ -0,0 +1,142 @@
+"""Run the CrewAI agents over one report.
+
+    python crew.py data/sample.pdf --query "Summarise my Blood Test Report"
+
+The report is extracted once up front. Tool outputs are memoized for the run,
+so every agent that reads the file, or sends the same text to a tool, reuses
+the first answer. The nutrition and exercise tasks run side by side. The
+result includes how long each agent took.
+"""
+import json
+import time
+import hashlib
+import argparse
+import threading
+from typing import Callable, Dict, Optional
+
+from pdf_extract import read_pdf_text, file_sha256
+
+# Verification first, the independent specialists in parallel, then the doctor
+# with their outputs as context
+CREW_TASK_ORDER = ("verification", "nutrition_analysis", "exercise_planning", "help_patients")
+READ_TOOL = "BloodTestReportTool"
+
+
+class CrewRun:
+    """State of one crew run, shared by the tools and agents on every crew thread"""
+
+    def __init__(self, file_path: str, doc_hash: str):
+        self.file_path = file_path
+        self.doc_hash = doc_hash
+        self.agent_seconds: Dict[str, float] = {}
+        self.tool_calls: Dict[str, Dict[str, int]] = {}
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def _key(self, tool: str, argument: str):
+        return tool, self.file_path, self.doc_hash, hashlib.sha256(argument.encode("utf-8")).hexdigest()
+
+    def prime(self, tool: str, argument: str, output: str):
+        with self._lock:
+            self._memo[self._key(tool, argument)] = output
+
+    def memoize(self, tool: str, argument: str, compute: Callable[[], str]) -> str:
+        key = self._key(tool, argument)
+        with self._lock:
+            calls = self.tool_calls.setdefault(tool, {"calls": 0, "hits": 0})
+            calls["calls"] += 1
+            if key in self._memo:
+                calls["hits"] += 1
+                return self._memo[key]
+        # Computed outside the lock; two agents asking at once may both compute
+        output = compute()
+        with self._lock:
+            return self._memo.setdefault(key, output)
+
+    def record_agent(self, role: str, seconds: float):
+        with self._lock:
+            self.agent_seconds[role] = self.agent_seconds.get(role, 0.0) + seconds
+
+
+# The run in progress. Agents and tasks are shared objects that keep their last
+# output, so a process runs one crew at a time.
+_run: Optional[CrewRun] = None
+_run_lock = threading.Lock()
+
+
+def memoize_tool(tool: str, argument: str, compute: Callable[[], str]) -> str:
+    """``compute()``, or the output of an identical call earlier in the current run"""
+    run = _run
+    if run is None:
+        return compute()
+    return run.memoize(tool, argument, compute)
+
+
+def record_agent_time(role: str, seconds: float):
+    run = _run
+    if run is not None:
+        run.record_agent(role, seconds)
+
+
+def run_crew(file_path: str, query: str = "Summarise my Blood Test Report") -> dict:
+    """Run every task on ``file_path`` and return the outputs with per-agent timing"""
+    global _run
+    from crewai import Crew, Process
+    from agents import get_agents
+    from task import get_tasks
+
+    agents = get_agents()
+    tasks = get_tasks()
+    with _run_lock:
+        start = time.perf_counter()
+        run = CrewRun(file_path, file_sha256(file_path))
+        run.prime(READ_TOOL, file_path, read_pdf_text(file_path, normalize=True))
+        extract_seconds = time.perf_counter() - start
+
+        crew = Crew(
+            agents=list(agents.values()),
+            tasks=[tasks[name] for name in CREW_TASK_ORDER],
+            process=Process.sequential,
+        )
+        _run = run
+        try:
+            output = crew.kickoff(inputs={"query": query, "file_path": file_path})
+        finally:
+            _run = None
+
+    roles = {agent.role: name for name, agent in agents.items()}
+    return {
+        "doc_hash": run.doc_hash,
+        "result": str(output),
+        "tasks": {name: str(tasks[name].output) if tasks[name].output else None for name in CREW_TASK_ORDER},
+        "timings": {
+            "extract_seconds": round(extract_seconds, 3),
+            "total_seconds": round(time.perf_counter() - start, 3),
+            "agents": {roles.get(role, role): round(seconds, 3) for role, seconds in run.agent_seconds.items()},
+        },
+        "tools": run.tool_calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file_path")
+    parser.add_argument("--query", default="Summarise my Blood Test Report")
+    parser.add_argument("--json", action="store_true", help="print the whole result as JSON")
+    args = parser.parse_args()
+
+    outcome = run_crew(args.file_path, args.query)
+    if args.json:
+        print(json.dumps(outcome, indent=2))
+        return
+    print(outcome["result"])
+    timings = outcome["timings"]
+    print(f"\nextract {timings['extract_seconds']:.2f}s, total {timings['total_seconds']:.2f}s")
+    for name, seconds in sorted(timings["agents"].items(), key=lambda item: -item[1]):
+        print(f"  {name:<20} {seconds:8.2f}s")
+    for tool, calls in outcome["tools"].items():
+        print(f"  {tool:<20} {calls['calls']} calls, {calls['hits']} memoized")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import os
+import time
+import zlib
+import base64
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, Column, String, Text, Float, Integer, Boolean, UniqueConstraint, inspect, text
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.declarative import declarative_base
+
+load_dotenv()
+
+# Database configuration
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./analysis_results.db")
+# Async driver URL used by the API's read endpoints; derived from DATABASE_URL when unset
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "")
+# Connection pool per engine (ignored for SQLite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Seconds before a pooled connection is replaced, to stay under server-side idle timeouts
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# zlib level for stored sections; 0 writes new sections uncompressed
+RESULT_COMPRESSION_LEVEL = int(os.getenv("RESULT_COMPRESSION_LEVEL", "6"))
+
+# Sync driver -> async driver for the same database
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+}
+
+
+def engine_options(url: str) -> dict:
+    """Pool settings for server databases, thread sharing for SQLite"""
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+class CompressedText(TypeDecorator):
+    """Text stored zlib-compressed and base64-encoded in a text column.
+
+    Values written uncompressed, by older versions or because compressing
+    didn't make them smaller, are read back as they are.
+    """
+
+    impl = Text
+    cache_ok = True
+    prefix = "zlib:"
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        # Plain text that happens to start with the prefix is always packed, so it can't be misread
+        ambiguous = value.startswith(self.prefix)
+        if RESULT_COMPRESSION_LEVEL <= 0 and not ambiguous:
+            return value
+        level = max(RESULT_COMPRESSION_LEVEL, 1)
+        packed = self.prefix + base64.b64encode(zlib.compress(value.encode("utf-8"), level)).decode("ascii")
+        return packed if ambiguous or len(packed) < len(value) else value
+
+    def process_result_value(self, value, dialect):
+        if value is None or not value.startswith(self.prefix):
+            return value
+        return zlib.decompress(base64.b64decode(value[len(self.prefix):])).decode("utf-8")
+
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base = declarative_base()
+
+_async_sessionmaker = None
+
+
+def AsyncSessionLocal():
+    """Session on the async engine, created on first use so workers never load the async driver"""
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        url = ASYNC_DATABASE_URL or async_url(DATABASE_URL)
+        options = engine_options(url)
+        options.pop("connect_args", None)
+        async_engine = create_async_engine(url, **options)
+        _async_sessionmaker = async_sessionmaker(async_engine, expire_on_commit=False)
+    return _async_sessionmaker()
+
+# Define the database model for storing analysis results
+class AnalysisResult(Base):
+    __tablename__ = "analysis_results"
+    id = Column(String, primary_key=True, index=True)
+    query = Column(String)
+    # "processing", "completed", "partial", "rejected" (not a blood test report) or "failed"; rows written before this column existed are complete
+    status = Column(String)
+    verification = Column(CompressedText)
+    medical_analysis = Column(CompressedText)
+    nutrition_plan = Column(CompressedText)
+    exercise_plan = Column(CompressedText)
+    # JSON object mapping a failed stage to its error message
+    stage_errors = Column(Text)
+    # JSON object mapping each stage to completed/failed/timeout/rejected/skipped/reused
+    stage_status = Column(Text)
+    # SHA-256 of the uploaded PDF
+    doc_hash = Column(String, index=True)
+    # JSON object mapping each section to the analysis_sections row it came from
+    section_refs = Column(Text)
+    # JSON list of sections taken from an earlier analysis instead of recomputed
+    reused_sections = Column(Text)
+    # Tokens spent by the stages run for this result (reused sections cost nothing)
+    input_tokens = Column(Integer)
+    output_tokens = Column(Integer)
+    # JSON object with per-stage input_tokens/output_tokens
+    token_usage = Column(Text)
+    # Set for results queued through /analyze/batch
+    batch_id = Column(String, index=True)
+    # Epoch seconds when the analysis started and when it reached a final status;
+    # the index serves /results listings and retention
+    created_at = Column(Float, index=True)
+    completed_at = Column(Float)
+
+# Result states that no longer change
+FINAL_STATUSES = ("completed", "partial", "rejected", "failed")
+
+# One /analyze/batch upload; its results are the AnalysisResult rows named in items
+class BatchRecord(Base):
+    __tablename__ = "batches"
+    id = Column(String, primary_key=True)
+    query = Column(String)
+    # JSON list of {filename, doc_hash, task_id, source} or {filename, error} per uploaded file
+    items = Column(Text, nullable=False)
+    total = Column(Integer, nullable=False)
+    created_at = Column(Float, nullable=False)
+
+# Maps a (document hash, normalized query) key to a finished AnalysisResult
+class ResultCacheEntry(Base):
+    __tablename__ = "result_cache"
+    key = Column(String, primary_key=True)
+    result_id = Column(String, nullable=False)
+    created_at = Column(Float, nullable=False)
+    last_access = Column(Float, nullable=False, index=True)
+
+# Extracted text of an uploaded report, shared by every query against it
+class DocumentRecord(Base):
+    __tablename__ = "documents"
+    doc_hash = Column(String, primary_key=True)
+    content = Column(Text, nullable=False)
+    # JSON list of markers parsed from the content (see markers.MarkerTable)
+    markers = Column(Text)
+    # True when content holds map-reduce extracts of a long report instead of its text
+    map_reduced = Column(Boolean, default=False)
+    created_at = Column(Float, nullable=False)
+
+# One generated section. Query-independent sections use an empty query_hash.
+class SectionRecord(Base):
+    __tablename__ = "analysis_sections"
+    __table_args__ = (UniqueConstraint("doc_hash", "query_hash", "section"),)
+    id = Column(String, primary_key=True)
+    doc_hash = Column(String, nullable=False, index=True)
+    query_hash = Column(String, nullable=False)
+    section = Column(String, nullable=False)
+    content = Column(CompressedText, nullable=False)
+    created_at = Column(Float, nullable=False)
+
+
+def add_missing_columns():
+    """Add columns introduced after an existing table was created"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            added = set()
+            for col in table.columns:
+                if col.name not in existing:
+                    col_type = col.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{col.name}" {col_type}'))
+                    added.add(col.name)
+            # Also covers indexes added later to columns that already existed
+            known = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in known or added & {col.name for col in index.columns}:
+                    index.create(conn, checkfirst=True)
+
+
+def stamp_undated_results():
+    """Date results stored before created_at existed at the time of the upgrade,
+    so listings and retention can order them"""
+    with engine.begin() as conn:
+        conn.execute(
+            AnalysisResult.__table__.update()
+            .where(AnalysisResult.created_at.is_(None))
+            .values(created_at=time.time())
+        )
+
+
+def init_db():
+    """Create missing tables, columns and indexes"""
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    stamp_undated_results()
+
+
+if __name__ == "__main__":
+    # Migration step for deploys: `python database.py`
+    init_db()
+    print(f"Schema is up to date on {engine.url.render_as_string(hide_password=True)}")
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "redis" lets the API stream events published by Celery workers, "memory" only
+# works when the analysis runs in the API process (eager or embedded mode)
+EVENT_BUS_BACKEND = os.getenv("EVENT_BUS_BACKEND", "memory" if os.getenv("TASK_BACKEND") == "embedded" else "redis")
+EVENT_BUS_REDIS_URL = os.getenv("EVENT_BUS_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+# Seconds a task's events are kept for late subscribers
+EVENT_STREAM_TTL = int(os.getenv("EVENT_STREAM_TTL", "3600"))
+EVENT_STREAM_MAXLEN = int(os.getenv("EVENT_STREAM_MAXLEN", "10000"))
+# How often subscribers wake up when nothing happens
+EVENT_POLL_INTERVAL = float(os.getenv("EVENT_POLL_INTERVAL", "1.0"))
+
+Event = Tuple[str, str, dict]
+
+
+class MemoryEventBus:
+    """Per-process event log, replayable from any position"""
+
+    def __init__(self, ttl: int = EVENT_STREAM_TTL):
+        self.ttl = ttl
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def publish(self, task_id: str, event: str, data: dict):
+        now = time.time()
+        with self._lock:
+            events, _ = self._streams.get(task_id, ([], now))
+            events.append((str(len(events)), event, data))
+            self._streams[task_id] = (events, now)
+            for key in [k for k, (_, touched) in self._streams.items() if now - touched > self.ttl]:
+                del self._streams[key]
+
+    def _read(self, task_id: str, start: int):
+        with self._lock:
+            events, _ = self._streams.get(task_id, ([], None))
+            return events[start:]
+
+    async def subscribe(self, task_id: str, last_id: Optional[str] = None) -> AsyncIterator[Optional[Event]]:
+        """Yield events after ``last_id``, or ``None`` on each idle poll"""
+        position = int(last_id) + 1 if last_id else 0
+        idle_since = time.monotonic()
+        while True:
+            events = self._read(task_id, position)
+            if not events:
+                if time.monotonic() - idle_since >= EVENT_POLL_INTERVAL:
+                    idle_since = time.monotonic()
+                    yield None
+                await asyncio.sleep(0.05)
+                continue
+            idle_since = time.monotonic()
+            for item in events:
+                position += 1
+                yield item
+
+
+class RedisEventBus:
+    """One Redis stream per task; workers append, the API reads with blocking XREAD"""
+
+    prefix = "analysis-events:"
+
+    def __init__(self, url: str = EVENT_BUS_REDIS_URL, ttl: int = EVENT_STREAM_TTL):
+        self.url = url
+        self.ttl = ttl
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self):
+        # Connected on first publish so importing this module doesn't load redis
+        if self._client is None:
+            import redis
+
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def publish(self, task_id: str, event: str, data: dict):
+        key = self.prefix + task_id
+        pipe = self.client.pipeline()
+        pipe.xadd(key, {"event": event, "data": json.dumps(data)}, maxlen=EVENT_STREAM_MAXLEN, approximate=True)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    async def subscribe(self, task_id: str, last_id: Optional[str] = None) -> AsyncIterator[Optional[Event]]:
+        import redis.asyncio
+
+        if self._async_client is None:
+            self._async_client = redis.asyncio.Redis.from_url(self.url)
+        key = self.prefix + task_id
+        position = last_id or "0-0"
+        while True:
+            response = await self._async_client.xread({key: position}, block=int(EVENT_POLL_INTERVAL * 1000), count=100)
+            if not response:
+                yield None
+                continue
+            for _, entries in response:
+                for entry_id, fields in entries:
+                    position = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+                    yield position, fields[b"event"].decode(), json.loads(fields[b"data"])
+
+
+def create_event_bus(backend: str = EVENT_BUS_BACKEND):
+    if backend == "memory":
+        return MemoryEventBus()
+    if backend == "redis":
+        return RedisEventBus()
+    raise ValueError(f"Unknown event bus backend: {backend}")
+
+
+event_bus = create_event_bus()
+
+
+def publish(task_id: str, event: str, **data):
+    """Best-effort publish; progress events must never fail an analysis"""
+    try:
+        event_bus.publish(task_id, event, data)
+    except Exception as exc:
+        logger.warning("Could not publish %s event for %s: %s", event, task_id, exc)
+
+
+def format_sse(event_id: Optional[str], event: str, data: dict) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class StageProgress:
+    """State of every stage of one run.
+
+    Each change is published as a ``stage_started``/``stage_completed`` event
+    and, when ``report`` is given, handed to it as ``{"stages": {...}}`` (the
+    Celery task uses this for ``update_state``).
+    """
+
+    def __init__(self, task_id: str, report: Optional[Callable[[dict], None]] = None):
+        self.task_id = task_id
+        self.report = report
+        self.stages = {}
+        # Stages given up on after a timeout, and whether the run has stored its outcome;
+        # a stage thread still running past either must not write anything
+        self.abandoned = set()
+        self.finished = False
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+
+    def abandon(self, stage: str):
+        with self._persist_lock:
+            self.abandoned.add(stage)
+
+    def finish(self):
+        with self._persist_lock:
+            self.finished = True
+
+    def live(self, stage: str) -> bool:
+        return not self.finished and stage not in self.abandoned
+
+    @contextmanager
+    def persisting(self, stage: str):
+        """Yield whether ``stage`` may still store its output, keeping ``abandon``
+        and ``finish`` waiting until it has"""
+        with self._persist_lock:
+            yield self.live(stage)
+
+    def expect(self, stages):
+        """Mark stages as pending before any of them starts"""
+        with self._lock:
+            for stage in stages:
+                self.stages.setdefault(stage, "pending")
+            snapshot = dict(self.stages)
+        self._report(snapshot)
+
+    def update(self, stage: str, status: str, **data):
+        with self._lock:
+            self.stages[stage] = status
+            snapshot = dict(self.stages)
+        if status == "running":
+            publish(self.task_id, "stage_started", stage=stage, **data)
+        else:
+            publish(self.task_id, "stage_completed", stage=stage, status=status, **data)
+        self._report(snapshot)
+
+    def _report(self, snapshot: dict):
+        if self.report is not None:
+            try:
+                self.report({"stages": snapshot})
+            except Exception as exc:
+                logger.warning("Could not report progress for %s: %s", self.task_id, exc)
@@ -0,0 +1,414 @@
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+from typing import Iterator, Optional
+
+from dotenv import load_dotenv
+
+from prompts import estimate_tokens, record_usage
+from metrics import LLM_CLIENT_EVENTS, LLM_RATE_LIMITED_SECONDS, LLM_REQUEST_SECONDS, LLM_TOKENS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-flash")
+# Provider quotas shared by every process using the same limiter backend; 0 disables a limit
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+# "redis" coordinates all API and worker processes, "local" limits each process, "none" disables
+LLM_RATE_LIMIT_BACKEND = os.getenv("LLM_RATE_LIMIT_BACKEND", "redis")
+LLM_RATE_LIMIT_REDIS_URL = os.getenv("LLM_RATE_LIMIT_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+# Attempts after the first one for retryable errors
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30.0"))
+# Seconds a call may take, including rate-limit waits and retries
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "120"))
+# Send Gemini calls over REST to this endpoint instead, e.g. benchmarks/fake_gemini.py
+LLM_API_ENDPOINT = os.getenv("LLM_API_ENDPOINT", "")
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call could not finish before its deadline"""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Quota, overload and transient transport errors are worth retrying"""
+    try:
+        from google.api_core import exceptions as gexc
+    except ImportError:
+        gexc = None
+    if gexc is not None and isinstance(exc, (
+        gexc.ResourceExhausted,
+        gexc.TooManyRequests,
+        gexc.ServiceUnavailable,
+        gexc.InternalServerError,
+        gexc.DeadlineExceeded,
+    )):
+        return True
+    return isinstance(exc, (ConnectionError, TimeoutError)) and not isinstance(exc, DeadlineExceeded)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+
+class SharedCall:
+    """Output of one in-flight model call, replayed to every caller that sent the same prompt"""
+
+    def __init__(self):
+        self._parts = []
+        self._done = False
+        self._error = None
+        self._changed = threading.Condition()
+
+    def put(self, text: str):
+        with self._changed:
+            self._parts.append(text)
+            self._changed.notify_all()
+
+    def finish(self, error: BaseException = None):
+        with self._changed:
+            self._done = True
+            self._error = error
+            self._changed.notify_all()
+
+    def follow(self, deadline: float) -> Iterator[str]:
+        """Every part so far, then each new one as it arrives; raises what the call raised"""
+        index = 0
+        while True:
+            with self._changed:
+                while index == len(self._parts) and not self._done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise DeadlineExceeded("The shared call did not finish before the deadline")
+                    self._changed.wait(remaining)
+                parts = self._parts[index:]
+                finished, error = self._done, self._error
+            index += len(parts)
+            yield from parts
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+class LocalTokenBucket:
+    """Request and token buckets for a single process"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.limits = (requests_per_minute, tokens_per_minute)
+        self.levels = [requests_per_minute, tokens_per_minute]
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self, tokens: int) -> float:
+        """Consume one request and ``tokens`` tokens, or return seconds to wait"""
+        costs = (1, tokens)
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.updated
+            self.updated = now
+            wait = 0.0
+            for i, limit in enumerate(self.limits):
+                if limit <= 0:
+                    continue
+                self.levels[i] = min(limit, self.levels[i] + elapsed * limit / 60.0)
+                # A request bigger than the whole bucket only waits for a full bucket
+                cost = min(costs[i], limit)
+                if self.levels[i] < cost:
+                    wait = max(wait, (cost - self.levels[i]) * 60.0 / limit)
+            if wait:
+                return wait
+            for i, limit in enumerate(self.limits):
+                if limit > 0:
+                    self.levels[i] -= min(costs[i], limit)
+            return 0.0
+
+
+# Both buckets live in one Redis hash so they are checked and consumed atomically.
+# Returns 0 when acquired, otherwise the milliseconds to wait.
+REDIS_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local limits = {tonumber(ARGV[2]), tonumber(ARGV[3])}
+local costs = {1, tonumber(ARGV[4])}
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'updated')
+local levels = {tonumber(state[1]) or limits[1], tonumber(state[2]) or limits[2]}
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+local wait = 0
+for i = 1, 2 do
+  if limits[i] > 0 then
+    levels[i] = math.min(limits[i], levels[i] + elapsed * limits[i] / 60000)
+    local cost = math.min(costs[i], limits[i])
+    if levels[i] < cost then
+      wait = math.max(wait, (cost - levels[i]) * 60000 / limits[i])
+    end
+  end
+end
+if wait == 0 then
+  for i = 1, 2 do
+    if limits[i] > 0 then levels[i] = levels[i] - math.min(costs[i], limits[i]) end
+  end
+end
+redis.call('HSET', KEYS[1], 'requests', levels[1], 'tokens', levels[2], 'updated', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+return math.ceil(wait)
+"""
+
+
+class RedisTokenBucket:
+    """Request and token buckets shared by every process talking to the same Redis"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, url: str, key: str):
+        import redis
+
+        self.limits = (requests_per_minute, tokens_per_minute)
+        self.key = key
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(REDIS_BUCKET_SCRIPT)
+
+    def try_acquire(self, tokens: int) -> float:
+        now_ms = int(time.time() * 1000)
+        wait_ms = self.script(keys=[self.key], args=[now_ms, self.limits[0], self.limits[1], tokens])
+        return int(wait_ms) / 1000.0
+
+
+class NoLimit:
+    def try_acquire(self, tokens: int) -> float:
+        return 0.0
+
+
+def create_limiter(backend: str = LLM_RATE_LIMIT_BACKEND, model_name: str = LLM_MODEL):
+    if backend == "none" or (LLM_REQUESTS_PER_MINUTE <= 0 and LLM_TOKENS_PER_MINUTE <= 0):
+        return NoLimit()
+    if backend == "redis":
+        try:
+            limiter = RedisTokenBucket(
+                LLM_REQUESTS_PER_MINUTE,
+                LLM_TOKENS_PER_MINUTE,
+                LLM_RATE_LIMIT_REDIS_URL,
+                f"llm-rate-limit:{model_name}",
+            )
+            limiter.client.ping()
+            return limiter
+        except Exception as exc:
+            logger.warning("Redis rate limiter unavailable (%s); limiting per process instead", exc)
+    return LocalTokenBucket(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+
+
+class GeminiClient:
+    """Gemini access shared by the API, the workers and the CrewAI tools.
+
+    Every call waits for the shared rate limiter, retries retryable errors with
+    jittered exponential backoff, and gives up at its deadline. Identical
+    prompts issued while one is already in flight, streamed or not, follow that
+    call instead of making their own.
+    """
+
+    def __init__(self, model_name: str = LLM_MODEL, limiter=None):
+        self.model_name = model_name
+        self._limiter = limiter
+        self._model = None
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.stats = {"calls": 0, "retries": 0, "errors": 0, "coalesced": 0, "rate_limited_seconds": 0.0}
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+
+                if LLM_API_ENDPOINT:
+                    genai.configure(
+                        api_key=os.getenv("GOOGLE_API_KEY") or "unused",
+                        transport="rest",
+                        client_options={"api_endpoint": LLM_API_ENDPOINT},
+                    )
+                else:
+                    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+                self._model = genai.GenerativeModel(self.model_name)
+            return self._model
+
+    @property
+    def limiter(self):
+        with self._lock:
+            if self._limiter is None:
+                self._limiter = create_limiter(model_name=self.model_name)
+            return self._limiter
+
+    def _count(self, stat: str, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+        if stat == "rate_limited_seconds":
+            LLM_RATE_LIMITED_SECONDS.inc(amount)
+        else:
+            LLM_CLIENT_EVENTS.inc(amount, event=stat)
+
+    def _wait_for_capacity(self, tokens: int, deadline: float):
+        while True:
+            wait = self.limiter.try_acquire(tokens)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise DeadlineExceeded("Rate limit wait would pass the call deadline")
+            self._count("rate_limited_seconds", wait)
+            time.sleep(wait)
+
+    def _retry_delay(self, exc: Exception, attempt: int, deadline: float) -> Optional[float]:
+        """Seconds to sleep before retrying, or None when the error should be raised"""
+        if attempt >= LLM_MAX_RETRIES or not is_retryable(exc):
+            self._count("errors")
+            return None
+        delay = backoff_delay(attempt)
+        if time.monotonic() + delay >= deadline:
+            self._count("errors")
+            return None
+        self._count("retries")
+        return delay
+
+    def _record_usage(self, response, prompt_tokens: int, text: str):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            input_tokens, output_tokens = usage.prompt_token_count, usage.candidates_token_count
+        else:
+            input_tokens, output_tokens = prompt_tokens, estimate_tokens(text)
+        record_usage(input_tokens, output_tokens)
+        LLM_TOKENS.inc(input_tokens, direction="input")
+        LLM_TOKENS.inc(output_tokens, direction="output")
+
+    def _send(self, prompt: str, tokens: int, deadline: float, **kwargs):
+        self._wait_for_capacity(tokens, deadline)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("Call deadline passed before the request was sent")
+        self._count("calls")
+        return self.model.generate_content(prompt, request_options={"timeout": remaining}, **kwargs)
+
+    def _call(self, prompt: str, deadline: float) -> str:
+        tokens = estimate_tokens(prompt)
+        attempt = 0
+        while True:
+            try:
+                response = self._send(prompt, tokens, deadline)
+                text = response.text
+            except Exception as exc:
+                delay = self._retry_delay(exc, attempt, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._record_usage(response, tokens, text)
+            return text
+
+    def _key(self, prompt: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def _join(self, key: str):
+        """``(shared, True)`` when an identical call is in flight, else a new ``(shared, False)`` to fill"""
+        with self._lock:
+            shared = self._in_flight.get(key)
+            if shared is not None:
+                joined = True
+            else:
+                shared = self._in_flight[key] = SharedCall()
+                joined = False
+        if joined:
+            self._count("coalesced")
+        return shared, joined
+
+    def _leave(self, key: str, shared: SharedCall, error: BaseException = None):
+        with self._lock:
+            if self._in_flight.get(key) is shared:
+                del self._in_flight[key]
+        shared.finish(error)
+
+    def stream(self, prompt: str, deadline: Optional[float] = None) -> Iterator[str]:
+        """Yield generated text as it arrives.
+
+        Errors before the first chunk are retried like ``generate``; once text
+        has been yielded a failure is raised, since the caller already has part
+        of the answer. A stream of a prompt already in flight replays that call's
+        text so far and then follows it; a non-streamed call arrives in one piece.
+        """
+        deadline = time.monotonic() + (LLM_CALL_DEADLINE if deadline is None else deadline)
+        key = self._key(prompt)
+        shared, joined = self._join(key)
+        if joined:
+            yield from shared.follow(deadline)
+            return
+
+        try:
+            with LLM_REQUEST_SECONDS.time(mode="stream"):
+                for text in self._stream(prompt, deadline):
+                    shared.put(text)
+                    yield text
+        except GeneratorExit:
+            # The caller stopped reading; followers can't get the rest of the answer
+            self._leave(key, shared, DeadlineExceeded("The shared call was abandoned"))
+            raise
+        except BaseException as exc:
+            self._leave(key, shared, exc)
+            raise
+        self._leave(key, shared)
+
+    def _stream(self, prompt: str, deadline: float) -> Iterator[str]:
+        tokens = estimate_tokens(prompt)
+        attempt = 0
+        while True:
+            parts = []
+            try:
+                response = self._send(prompt, tokens, deadline, stream=True)
+                for chunk in response:
+                    text = chunk.text
+                    if text:
+                        parts.append(text)
+                        yield text
+            except Exception as exc:
+                delay = None if parts else self._retry_delay(exc, attempt, deadline)
+                if delay is None:
+                    if parts:
+                        self._count("errors")
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._record_usage(response, tokens, "".join(parts))
+            return
+
+    def generate(self, prompt: str, deadline: Optional[float] = None) -> str:
+        """Generate text for a prompt, giving up after ``deadline`` seconds"""
+        deadline = time.monotonic() + (LLM_CALL_DEADLINE if deadline is None else deadline)
+        key = self._key(prompt)
+        shared, joined = self._join(key)
+        if joined:
+            return "".join(shared.follow(deadline))
+
+        try:
+            with LLM_REQUEST_SECONDS.time(mode="generate"):
+                text = self._call(prompt, deadline)
+        except BaseException as exc:
+            self._leave(key, shared, exc)
+            raise
+        shared.put(text)
+        self._leave(key, shared)
+        return text
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> GeminiClient:
+    """Process-wide shared client"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GeminiClient()
+    return _client
@@ -1,66 +1,146 @@
-import uvicorn
 import asyncio
 import sys
 import os
+import re
+import json
+import time
 import uuid
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-import google.generativeai as genai
+import logging
+from contextlib import aclosing
+from typing import List, Optional
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
 from celery import Celery
-from sqlalchemy import create_engine, Column, String, Text, inspect
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import select
+from database import SessionLocal, AsyncSessionLocal, AnalysisResult, FINAL_STATUSES, init_db
+from cache import result_cache, result_rows, etag_matches, serialize_result
+from pdf_extract import read_pdf_text, iter_pages, file_sha256
+from sections import load_document_text, save_document_text, load_document_markers, load_sections, save_sections
+from markers import MarkerTable, extract_markers
+from chunking import collect_pages
+from uploads import (
+    save_upload, save_zip_upload, extract_zip_pdfs, remove_file, remove_stale_uploads,
+    UploadSizeLimit, UPLOAD_MAX_BYTES, UPLOAD_MAX_BATCH_BYTES, MULTIPART_OVERHEAD,
+)
+from prompts import build_prompt, normalize_report_text, compact_report, take_usage
+from llm_client import get_client
+from pipeline import (
+    run_stages, StageRejected, ANALYSIS_STAGE_TIMEOUT, ANALYSIS_STREAMING,
+    VERIFICATION_GATE, VERIFICATION_GATE_MIN_MARKERS,
+)
+from events import event_bus, publish, format_sse, StageProgress
+from batches import save_batch, batch_status, BATCH_MAX_FILES, BATCH_MAX_CONCURRENCY, BATCH_SLOTS_KEY
+from callbacks import validate_callback_url, post_callback, retry_countdown, CallbackRejected, CALLBACK_MAX_RETRIES
+from workers import create_task_backend, QueueFull, ShuttingDown, PRIORITIES, TASK_BACKEND
+from slots import acquire_all, release_all, SLOT_RETRY_DELAY
+from tenants import tenant_id, tenant_limit, tenant_slots_key, ANONYMOUS_TENANT
+from metrics import (
+    registry, CONTENT_TYPE, UPLOAD_SECONDS, PAYLOAD_BYTES, ANALYSIS_SECONDS, STAGE_SECONDS,
+    STAGE_OUTCOMES, STAGE_TOKENS, DB_WRITE_SECONDS,
+)
+from tracing import span
+from results import (
+    list_statement, result_page, purge_results, retention_enabled, InvalidCursor,
+    RESULT_LIST_MAX, RESULT_RETENTION_INTERVAL,
+)
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure Gemini directly using the API key from environment variables
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-model = genai.GenerativeModel('gemini-1.5-flash')
-
 # Initialize FastAPI app
 app = FastAPI(title="Blood Test Report Analyser")
+app.add_middleware(UploadSizeLimit, limits={
+    "/analyze": UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD,
+    "/analyze/batch": UPLOAD_MAX_BATCH_BYTES + MULTIPART_OVERHEAD,
+})
 
-# Celery configuration
-celery = Celery(
-    "tasks",
-    broker=os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"),
-    backend=os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
-)
+def create_celery_app() -> Celery:
+    from celery.signals import worker_init
+
+    celery_app = Celery(
+        "tasks",
+        broker=os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"),
+        backend=os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+    )
+    # Record STARTED as soon as a worker picks a task up, before its first progress update
+    celery_app.conf.task_track_started = True
+    # Workers create missing tables once at start-up, as the API does in its startup hook
+    worker_init.connect(prepare_worker_database, weak=False)
+    return celery_app
+
+def prepare_worker_database(**_):
+    init_db()
 
-# Database configuration
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./analysis_results.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+# Only built in Celery mode, where `celery -A main worker` finds it; embedded mode skips its import cost
+celery = create_celery_app() if TASK_BACKEND == "celery" else None
 
-# Define the database model for storing analysis results
-class AnalysisResult(Base):
-    __tablename__ = "analysis_results"
-    id = Column(String, primary_key=True, index=True)
-    query = Column(String)
-    verification = Column(Text)
-    medical_analysis = Column(Text)
-    nutrition_plan = Column(Text)
-    exercise_plan = Column(Text)
+# Tasks run on Celery workers, or inside this process when TASK_BACKEND=embedded
+tasks = create_task_backend(celery)
 
-# Create the database table if it doesn't exist
-if not inspect(engine).has_table("analysis_results"):
-    Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
+
+# Columns of AnalysisResult that hold generated sections, in display order
+SECTION_NAMES = ("verification", "medical_analysis", "nutrition_plan", "exercise_plan")
+# Seconds /results/{task_id}/stream waits without any event before giving up
+SSE_IDLE_TIMEOUT = float(os.getenv("SSE_IDLE_TIMEOUT", "300"))
+# Longest ?wait= a client may ask for on /tasks and /results
+TASK_WAIT_MAX = float(os.getenv("TASK_WAIT_MAX", "60"))
+# Stage states that won't change any more
+STAGE_DONE = ("completed", "failed", "timeout", "rejected", "skipped", "reused")
 
 
 def read_pdf(file_path: str) -> str:
     """Read PDF content"""
-    docs = PyPDFLoader(file_path=file_path).load()
-    content = ""
-    for doc in docs:
-        content += doc.page_content + "\n"
-    return content
+    return read_pdf_text(file_path)
+
+def iter_pdf_pages(file_path: str, doc_hash: str = None):
+    """Yield the text of each PDF page without loading the whole document"""
+    return iter_pages(file_path, doc_hash)
 
-def verify_document(content: str) -> str:
+def generate(prompt: str, on_delta=None) -> str:
+    """Run a single Gemini generation bounded by the stage timeout"""
+    # The shared client handles rate limiting, retries and coalescing of identical prompts
+    client = get_client()
+    if on_delta is None or not ANALYSIS_STREAMING:
+        return client.generate(prompt, deadline=ANALYSIS_STAGE_TIMEOUT)
+    parts = []
+    for delta in client.stream(prompt, deadline=ANALYSIS_STAGE_TIMEOUT):
+        parts.append(delta)
+        on_delta(delta)
+    return "".join(parts)
+
+def gate_document(content: str, markers: MarkerTable = None) -> str:
+    """Cheap check that the upload is a blood test report before any expensive stage runs.
+
+    Returns why the report was accepted, or raises ``StageRejected``.
+    """
+    found = len(markers) if markers is not None else 0
+    if VERIFICATION_GATE != "model" and found >= VERIFICATION_GATE_MIN_MARKERS:
+        return f"Accepted: {found} lab markers found"
+    if VERIFICATION_GATE == "heuristic":
+        raise StageRejected(f"Not a blood test report: only {found} lab markers found")
+
+    template = """
+    Is the following document a blood test or laboratory report? Answer with exactly one word: YES or NO.
+    
+    Document Content:
+    {content}
+    """
+    try:
+        answer = generate(build_prompt("gate", template, content))
+    except Exception as exc:
+        # Don't drop a report because the gate itself failed; the stages will retry the model
+        return f"Accepted without verification: {type(exc).__name__}"
+    first_word = re.match(r"\W*(\w*)", answer).group(1).upper()
+    if first_word != "NO":
+        return f"Accepted by verification ({found} lab markers found)"
+    raise StageRejected("Not a blood test report: the document was rejected by verification")
+
+def verify_document(content: str, on_delta=None) -> str:
     """Verify if document is a blood test report"""
-    prompt = f"""
+    template = """
     As a Document Verification Specialist, analyze this document and confirm if it's a valid blood test report.
     
     Document Content:
@@ -72,12 +152,11 @@ def verify_document(content: str) -> str:
     3. List of main blood markers/tests included
     4. Overall document quality assessment
     """
-    response = model.generate_content(prompt)
-    return response.text
+    return generate(build_prompt("verification", template, content), on_delta)
 
-def medical_analysis(content: str, query: str) -> str:
+def medical_analysis(content: str, query: str, on_delta=None) -> str:
     """Medical doctor analysis"""
-    prompt = f"""
+    template = """
     As an experienced Medical Doctor, analyze this blood test report and provide comprehensive medical insights.
     
     Blood Test Report:
@@ -94,12 +173,11 @@ def medical_analysis(content: str, query: str) -> str:
     
     Be thorough but include appropriate medical disclaimers.
     """
-    response = model.generate_content(prompt)
-    return response.text
+    return generate(build_prompt("medical_analysis", template, content, query=query), on_delta)
 
-def nutrition_analysis(content: str, query: str) -> str:
+def nutrition_analysis(content: str, query: str, on_delta=None) -> str:
     """Clinical nutritionist analysis"""
-    prompt = f"""
+    template = """
     As a Clinical Nutritionist, analyze this blood test report and provide detailed nutrition recommendations.
     
     Blood Test Report:
@@ -118,12 +196,11 @@ def nutrition_analysis(content: str, query: str) -> str:
     
     Be specific and actionable.
     """
-    response = model.generate_content(prompt)
-    return response.text
+    return generate(build_prompt("nutrition_plan", template, content, query=query), on_delta)
 
-def exercise_analysis(content: str, query: str) -> str:
+def exercise_analysis(content: str, query: str, on_delta=None) -> str:
     """Exercise physiologist analysis"""
-    prompt = f"""
+    template = """
     As an Exercise Physiologist, analyze this blood test report and create a tailored exercise program.
     
     Blood Test Report:
@@ -142,44 +219,366 @@ def exercise_analysis(content: str, query: str) -> str:
     
     Consider any contraindications from the blood work.
     """
-    response = model.generate_content(prompt)
-    return response.text
-
+    return generate(build_prompt("exercise_plan", template, content, query=query), on_delta)
 
-@celery.task(bind=True)
-def analyze_blood_report_task(self, file_path: str, query: str):
-    """Celery task for comprehensive analysis that uses its own ID for the DB."""
-    pdf_content = read_pdf(file_path)
-    if "Error" in pdf_content:
-        # Handle error appropriately
-        return {"error": pdf_content}
+def extract_chunk(content: str) -> str:
+    """Map step for long reports: pull the facts out of one part of the report"""
+    template = """
+    You are reading one part of a longer blood test report. Extract its contents without interpreting them.
     
-    analysis = {
-        "verification": verify_document(pdf_content),
-        "medical_analysis": medical_analysis(pdf_content, query),
-        "nutrition_plan": nutrition_analysis(pdf_content, query),
-        "exercise_plan": exercise_analysis(pdf_content, query)
+    Report Part:
+    {content}
+    
+    List, as short plain lines:
+    1. Every test result as "name: value unit (reference range)", keeping any high/low flags
+    2. Laboratory name, sample dates and patient details if present
+    3. Any clinician comments or notes about the results
+    
+    Skip page headers, addresses and legal text.
+    """
+    return generate(build_prompt("map_extract", template, normalize_report_text(content)))
 
-    }
+def condense_extracts(content: str) -> str:
+    """Reduce step for long reports: merge several extracts into one shorter list"""
+    template = """
+    Merge these extracts from parts of the same blood test report into one list.
     
-    # Store result in database
+    Extracts:
+    {content}
+    
+    Keep every test result with its value, unit, reference range and flag. Remove duplicates
+    and repeated header details. Do not add interpretation.
+    """
+    return generate(build_prompt("map_reduce", template, content))
+
+def update_result(task_id: str, **fields):
+    """Write some columns of an AnalysisResult row"""
     db = SessionLocal()
-    # Use the Celery task's own ID as the primary key
-    db_result = AnalysisResult(
-        id=self.request.id,
-        query=query,
-        **analysis
+    try:
+        with DB_WRITE_SECONDS.time(operation="update_result"):
+            db.query(AnalysisResult).filter(AnalysisResult.id == task_id).update(fields)
+            db.commit()
+    finally:
+        db.close()
+
+def tracked_stage(task_id: str, name: str, fn, usage: dict, progress: StageProgress):
+    """Wrap a stage so its output streams to subscribers, its progress is reported,
+    its section is saved as soon as it finishes and the tokens it spends are
+    recorded under its name"""
+    def on_delta(delta):
+        if progress.live(name):
+            publish(task_id, "delta", stage=name, text=delta)
+
+    def run():
+        take_usage()
+        progress.update(name, "running")
+        status = "failed"
+        start = time.perf_counter()
+        try:
+            with span(name, task_id, stage=name):
+                text = fn(on_delta)
+            status = "completed"
+        except StageRejected as exc:
+            status = "rejected"
+            with progress.persisting(name) as live:
+                if live:
+                    progress.update(name, "rejected", reason=str(exc))
+            raise
+        except Exception as exc:
+            with progress.persisting(name) as live:
+                if live:
+                    progress.update(name, "failed", error=f"{type(exc).__name__}: {exc}")
+            raise
+        finally:
+            spent = take_usage()
+            with progress.persisting(name) as live:
+                if live:
+                    usage[name] = spent
+                else:
+                    status = "timeout"
+            record_stage(name, status, time.perf_counter() - start, spent)
+        # A stage that outlived its timeout, or the run, leaves the stored result alone
+        with progress.persisting(name) as live:
+            if live:
+                if name in SECTION_NAMES:
+                    update_result(task_id, **{name: text})
+                progress.update(name, "completed")
+        return text
+    return run
+
+def record_stage(name: str, status: str, seconds: float, spent: Optional[dict]):
+    """Feed one finished step into the stage metrics"""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    STAGE_OUTCOMES.inc(stage=name, status=status)
+    for direction in ("input", "output"):
+        tokens = (spent or {}).get(f"{direction}_tokens")
+        if tokens:
+            STAGE_TOKENS.inc(tokens, stage=name, direction=direction)
+
+def run_analysis(
+    task_id: str,
+    file_path: str,
+    query: str,
+    doc_hash: str = None,
+    batch_id: str = None,
+    report_progress=None,
+) -> dict:
+    """Analyse one uploaded report and store the result under ``task_id``.
+
+    ``report_progress`` receives ``{"stages": {name: status}}`` whenever a stage changes.
+    """
+    if doc_hash is None:
+        doc_hash = file_sha256(file_path)
+
+    # Create the row up front so sections can be saved, and polled, as they finish.
+    # Use the Celery task's own ID as the primary key.
+    db = SessionLocal()
+    with DB_WRITE_SECONDS.time(operation="create_result"):
+        db.add(AnalysisResult(id=task_id, query=query, doc_hash=doc_hash, status="processing", batch_id=batch_id, created_at=time.time()))
+        db.commit()
+    db.close()
+
+    start = time.perf_counter()
+    progress = StageProgress(task_id, report_progress)
+    try:
+        with span("analysis", task_id, doc_hash=doc_hash, batch_id=batch_id):
+            outcome = _run_analysis(task_id, file_path, query, doc_hash, progress)
+    except Exception as exc:
+        ANALYSIS_SECONDS.observe(time.perf_counter() - start, status="error")
+        progress.finish()
+        update_result(
+            task_id,
+            status="failed",
+            stage_errors=json.dumps({"task": f"{type(exc).__name__}: {exc}"}),
+            completed_at=time.time(),
+        )
+        publish(task_id, "completed", status="failed")
+        raise
+    ANALYSIS_SECONDS.observe(time.perf_counter() - start, status=outcome.get("status", "failed"))
+    publish(task_id, "completed", status=outcome.get("status", "failed"), errors=outcome.get("errors", {}))
+    return outcome
+
+def _run_analysis(task_id: str, file_path: str, query: str, doc_hash: str, progress: StageProgress) -> dict:
+    # A report seen before doesn't need to be parsed again
+    usage = {}
+    pdf_content = load_document_text(doc_hash)
+    if pdf_content is None:
+        # Pages are read lazily; long reports are chunked and condensed in parallel
+        # so neither memory nor prompt size grows with the page count.
+        page_markers = []
+
+        def scan(pages):
+            for page in pages:
+                page_markers.append(extract_markers(page))
+                yield page
+
+        # Map and reduce calls run on pool threads and add their tokens here
+        map_usage = {"input_tokens": 0, "output_tokens": 0}
+        start = time.perf_counter()
+        try:
+            with span("read_pdf", task_id, doc_hash=doc_hash):
+                pdf_content, map_reduced = collect_pages(
+                    scan(iter_pdf_pages(file_path, doc_hash)), extract_chunk, condense_extracts, usage=map_usage
+                )
+        except Exception:
+            # Extraction raises on an unreadable PDF; run_analysis marks the result failed
+            record_stage("read_pdf", "failed", time.perf_counter() - start, map_usage)
+            raise
+        if map_reduced:
+            usage["map_reduce"] = map_usage
+        record_stage("read_pdf", "completed", time.perf_counter() - start, usage.get("map_reduce"))
+        markers = MarkerTable.concat(page_markers)
+        save_document_text(doc_hash, pdf_content, markers.to_json(), map_reduced)
+    else:
+        markers = load_document_markers(doc_hash)
+
+    # Normalize the text once; the query stages may get the marker table instead
+    report = normalize_report_text(pdf_content)
+    clinical_report = compact_report(report, markers)
+
+    # Verification is keyed on the document only, the other sections on the
+    # document and query. Anything already stored is linked instead of recomputed.
+    reused = load_sections(doc_hash, query)
+    if reused:
+        update_result(task_id, **{name: content for name, (_, content) in reused.items()})
+    for name, (_, content) in reused.items():
+        publish(task_id, "delta", stage=name, text=content)
+        progress.update(name, "reused")
+
+    stages = {
+        "gate": lambda on_delta: gate_document(report, markers),
+        "verification": lambda on_delta: verify_document(report, on_delta),
+        "medical_analysis": lambda on_delta: medical_analysis(clinical_report, query, on_delta),
+        "nutrition_plan": lambda on_delta: nutrition_analysis(clinical_report, query, on_delta),
+        "exercise_plan": lambda on_delta: exercise_analysis(clinical_report, query, on_delta),
+    }
+    # A stored verification means the document already passed the gate
+    if VERIFICATION_GATE == "off" or "verification" in reused:
+        del stages["gate"]
+    pending = {name: tracked_stage(task_id, name, fn, usage, progress) for name, fn in stages.items() if name not in reused}
+    progress.expect(pending)
+
+    # Every section waits for the gate, so a rejected upload costs at most one
+    # short model call. The sections don't depend on each other and run side
+    # by side; a failing stage leaves its column empty and is recorded in stage_errors.
+    requires = {name: ("gate",) for name in SECTION_NAMES}
+    analysis, errors, statuses = run_stages(pending, requires, on_timeout=progress.abandon) if pending else ({}, {}, {})
+    rejected = statuses.get("gate") == "rejected"
+    for name, status in statuses.items():
+        # Stages that never ran, or were abandoned, didn't report it themselves
+        if status in ("skipped", "timeout"):
+            progress.update(name, status)
+    statuses.update({name: "reused" for name in reused})
+
+    sections = {name: out for name, out in analysis.items() if name in SECTION_NAMES and out is not None}
+    section_refs = save_sections(doc_hash, query, sections)
+    for name, (section_id, _) in reused.items():
+        section_refs[name] = section_id
+
+    # Sections are already saved; record how the run went. Stages still running
+    # past their timeout must not write after this.
+    progress.finish()
+    fields = {"verification": analysis["gate"]} if rejected else {}
+    update_result(
+        task_id,
+        status="rejected" if rejected else "partial" if errors else "completed",
+        stage_errors=json.dumps(errors) if errors else None,
+        stage_status=json.dumps(statuses),
+        section_refs=json.dumps(section_refs),
+        reused_sections=json.dumps(sorted(reused)),
+        input_tokens=sum(u["input_tokens"] for u in usage.values()),
+        output_tokens=sum(u["output_tokens"] for u in usage.values()),
+        token_usage=json.dumps(usage),
+        completed_at=time.time(),
+        **fields,
     )
-    db.add(db_result)
-    db.commit()
-    db.refresh(db_result)
+
+    # Only complete analyses (and rejections) are reused for duplicate uploads
+    if not errors:
+        result_cache.set(doc_hash, query, task_id)
+
+    if rejected:
+        return {"status": "rejected", "result_id": task_id, "reason": analysis["gate"]}
+    if errors:
+        return {"status": "partial", "result_id": task_id, "errors": errors}
+    return {"status": "success", "result_id": task_id}
+
+def hold_slots(task, claims):
+    """Take every slot in ``claims`` or send the task back to its queue to try again later"""
+    if not acquire_all(task.task_id, claims):
+        # Requeue rather than tie up a worker waiting for a slot
+        task.retry(countdown=SLOT_RETRY_DELAY)
+
+@tasks.task(max_retries=None)
+def analyze_blood_report_task(task, file_path: str, query: str, doc_hash: str = None, callback_url: str = None,
+                              tenant: str = ANONYMOUS_TENANT):
+    """Comprehensive analysis stored under the task's own ID. Runs within the
+    tenant's concurrency quota so one API key can't occupy every worker."""
+    claims = [(tenant_slots_key(tenant), tenant_limit(tenant))]
+    hold_slots(task, claims)
+    try:
+        return run_analysis(task.task_id, file_path, query, doc_hash, report_progress=task.update_state)
+    finally:
+        # Clean up the file whether the analysis succeeded or not
+        release_all(task.task_id, claims)
+        remove_file(file_path)
+        if callback_url:
+            schedule_callback(callback_url, task.task_id)
+
+@tasks.task(max_retries=CALLBACK_MAX_RETRIES)
+def deliver_callback_task(task, callback_url: str, task_id: str):
+    """POST a finished result to the callback URL given at /analyze time"""
+    db = SessionLocal()
+    try:
+        result = db.get(AnalysisResult, task_id)
+    finally:
+        db.close()
+    if result is None:
+        return
+    data, _ = serialize_result(result)
+    try:
+        post_callback(callback_url, {"task_id": task_id, "status": data["status"] or "completed", "result": data})
+    except CallbackRejected as exc:
+        logger.warning("Not sending the callback for %s: %s", task_id, exc)
+    except Exception as exc:
+        task.retry(countdown=retry_countdown(task.retries), exc=exc)
+
+def schedule_callback(callback_url: str, task_id: str):
+    try:
+        deliver_callback_task.submit(callback_url, task_id)
+    except Exception as exc:
+        logger.warning("Could not queue the callback for %s: %s", task_id, exc)
+
+@tasks.task(max_retries=None, queue="bulk")
+def analyze_batch_item_task(task, file_path: str, query: str, doc_hash: str, batch_id: str,
+                            tenant: str = ANONYMOUS_TENANT):
+    """One report of a batch. Holds a global batch slot as well as a tenant slot
+    so bulk loads can't take every worker and model call away from single uploads."""
+    # Batch slot first, so items waiting on it never hold a tenant slot meanwhile
+    claims = [(BATCH_SLOTS_KEY, BATCH_MAX_CONCURRENCY), (tenant_slots_key(tenant), tenant_limit(tenant))]
+    hold_slots(task, claims)
+    try:
+        return run_analysis(task.task_id, file_path, query, doc_hash, batch_id, task.update_state)
+    finally:
+        release_all(task.task_id, claims)
+        remove_file(file_path)
+
+def cached_result_id(doc_hash: str, query: str):
+    """ID of a stored result for the same report and query, if it still exists"""
+    cached_id = result_cache.get(doc_hash, query)
+    if cached_id is None:
+        return None
+    db = SessionLocal()
+    exists = db.query(AnalysisResult.id).filter(AnalysisResult.id == cached_id).first() is not None
     db.close()
-    
-    # Clean up the file after processing
-    if os.path.exists(file_path):
-        os.remove(file_path)
-        
-    return {"status": "success", "result_id": self.request.id}
+    if exists:
+        return cached_id
+    result_cache.invalidate(doc_hash, query)
+    return None
+
+@app.on_event("startup")
+def prepare_database():
+    # Create any missing tables and columns; `python database.py` does the same ahead of a deploy
+    init_db()
+
+@app.on_event("startup")
+def clean_stale_uploads():
+    remove_stale_uploads()
+
+@app.on_event("startup")
+def start_task_backend():
+    tasks.start()
+
+async def purge_expired_results():
+    while True:
+        try:
+            removed = await run_in_threadpool(purge_results)
+            if any(removed.values()):
+                logger.info("Retention removed %s", removed)
+        except Exception:
+            logger.exception("Result retention failed")
+        await asyncio.sleep(RESULT_RETENTION_INTERVAL)
+
+@app.on_event("startup")
+async def start_retention():
+    if retention_enabled():
+        app.state.retention = asyncio.create_task(purge_expired_results())
+
+@app.on_event("shutdown")
+def drain_task_backend():
+    # Embedded mode finishes queued analyses before the process exits
+    tasks.shutdown()
+
+@app.on_event("shutdown")
+def stop_retention():
+    retention = getattr(app.state, "retention", None)
+    if retention is not None:
+        retention.cancel()
+
+def queue_unavailable(exc: QueueFull) -> HTTPException:
+    if isinstance(exc, ShuttingDown):
+        return HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "30"})
+    return HTTPException(status_code=429, detail=f"Too many reports are waiting: {exc}", headers={"Retry-After": "10"})
 
 @app.get("/")
 async def root():
@@ -188,40 +587,353 @@ async def root():
 @app.post("/analyze")
 async def analyze_blood_report_endpoint(
     file: UploadFile = File(...),
-    query: str = Form(default="Summarise my Blood Test Report")
+    query: str = Form(default="Summarise my Blood Test Report"),
+    callback_url: Optional[str] = Form(default=None),
+    priority: str = Form(default="normal"),
+    x_api_key: Optional[str] = Header(default=None)
 ):
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of: {', '.join(PRIORITIES)}")
+    if callback_url:
+        # Resolves the host, so keep it off the event loop
+        await run_in_threadpool(validate_callback_url, callback_url)
     
-    file_id = str(uuid.uuid4())
-    file_path = f"data/blood_test_report_{file_id}.pdf"
-    
-    os.makedirs("data", exist_ok=True)
-    
-    with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
-    
+    # The id is chosen here so the upload and the analysis share one trace
+    task_id = str(uuid.uuid4())
+
+    # Stream to disk, hashing and size-checking in the same pass
+    with span("upload", task_id, filename=file.filename), UPLOAD_SECONDS.time():
+        file_path, doc_hash, size = await save_upload(file)
+    PAYLOAD_BYTES.observe(size, kind="upload")
 
-    task = analyze_blood_report_task.delay(file_path, query)
+    # Identical report and query: hand back the stored result without queuing work
+    cached_id = await run_in_threadpool(cached_result_id, doc_hash, query)
+    if cached_id is not None:
+        remove_file(file_path)
+        if callback_url:
+            await run_in_threadpool(schedule_callback, callback_url, cached_id)
+        return {
+            "status": "completed",
+            "task_id": cached_id,
+            "cached": True,
+            "message": "An identical report was already analysed. Use the task_id to fetch the result."
+        }
+
+    try:
+        # Low-priority uploads wait with the batches instead of ahead of other users.
+        # Submitting talks to the broker, so it runs off the event loop.
+        task_id = await run_in_threadpool(
+            analyze_blood_report_task.submit,
+            file_path, query, doc_hash, callback_url, tenant_id(x_api_key),
+            queue="bulk" if priority == "low" else "interactive",
+            priority=priority,
+            task_id=task_id,
+        )
+    except Exception as exc:
+        # Nothing will ever pick the file up if queuing failed. A cancelled request
+        # leaves it to the stale-upload sweep, as the task may have been queued anyway.
+        remove_file(file_path)
+        if isinstance(exc, QueueFull):
+            raise queue_unavailable(exc)
+        raise
     
     return {
         "status": "processing",
-        "task_id": task.id,
+        "task_id": task_id,
         "message": "Your request is being processed. Use the task_id to check the status."
     }
 
+def queue_batch(uploads: list, query: str, batch_id: str, tenant: str) -> List[dict]:
+    """Queue one analysis per distinct report of a batch and return the batch items.
+    Blocking: the cache lookups and submits talk to Redis and the broker."""
+    items = []
+    # doc_hash -> task_id of the analysis every copy of that report shares
+    analyses = {}
+    for index, (name, file_path, doc_hash, error) in enumerate(uploads):
+        if error is not None:
+            items.append({"filename": name, "error": error})
+            continue
+        if doc_hash in analyses:
+            remove_file(file_path)
+            items.append({"filename": name, "doc_hash": doc_hash, "task_id": analyses[doc_hash], "source": "duplicate"})
+            continue
+        cached_id = cached_result_id(doc_hash, query)
+        if cached_id is not None:
+            remove_file(file_path)
+            analyses[doc_hash] = cached_id
+            items.append({"filename": name, "doc_hash": doc_hash, "task_id": cached_id, "source": "cached"})
+            continue
+        try:
+            task_id = analyze_batch_item_task.submit(file_path, query, doc_hash, batch_id, tenant)
+        except QueueFull as exc:
+            # The rest of the batch still gets its chance; this file can be resubmitted
+            remove_file(file_path)
+            items.append({"filename": name, "doc_hash": doc_hash, "error": queue_unavailable(exc).detail})
+            continue
+        except Exception:
+            # Files already queued belong to their tasks; the rest would never be picked up
+            for _, rest_path, _, _ in uploads[index:]:
+                if rest_path:
+                    remove_file(rest_path)
+            raise
+        analyses[doc_hash] = task_id
+        items.append({"filename": name, "doc_hash": doc_hash, "task_id": task_id, "source": "queued"})
+    return items
+
+@app.post("/analyze/batch")
+async def analyze_batch_endpoint(
+    files: List[UploadFile] = File(...),
+    query: str = Form(default="Summarise my Blood Test Report"),
+    x_api_key: Optional[str] = Header(default=None)
+):
+    """Queue many reports at once. Accepts PDFs and zip archives of PDFs; identical
+    files are analysed once and every report is tracked under one batch id."""
+    # (filename, file_path, doc_hash, error) per report; a bad file only rejects itself
+    uploads = []
+    try:
+        for file in files:
+            name = file.filename or ""
+            if name.lower().endswith(".zip"):
+                zip_path = await save_zip_upload(file)
+                try:
+                    uploads.extend(await run_in_threadpool(extract_zip_pdfs, zip_path, BATCH_MAX_FILES - len(uploads)))
+                finally:
+                    remove_file(zip_path)
+            elif name.lower().endswith(".pdf"):
+                try:
+                    file_path, doc_hash, _ = await save_upload(file)
+                except HTTPException as exc:
+                    uploads.append((name, None, None, exc.detail))
+                else:
+                    uploads.append((name, file_path, doc_hash, None))
+            else:
+                uploads.append((name, None, None, "Only PDF and zip files are supported"))
+            if len(uploads) > BATCH_MAX_FILES:
+                raise HTTPException(status_code=400, detail=f"A batch may hold at most {BATCH_MAX_FILES} files")
+    except BaseException:
+        for _, file_path, _, _ in uploads:
+            if file_path:
+                remove_file(file_path)
+        raise
+
+    batch_id = str(uuid.uuid4())
+    created_at = time.time()
+    tenant = tenant_id(x_api_key)
+    # One trip to the thread pool for the whole fan-out; each submit is blocking broker I/O
+    items = await run_in_threadpool(queue_batch, uploads, query, batch_id, tenant)
+    await run_in_threadpool(save_batch, batch_id, query, items, created_at)
+    sources = [item.get("source", "rejected") for item in items]
+    return {
+        "status": "processing",
+        "batch_id": batch_id,
+        "total": len(items),
+        "queued": sources.count("queued"),
+        "cached": sources.count("cached"),
+        "duplicates": sources.count("duplicate"),
+        "rejected": sources.count("rejected"),
+        "message": "Your reports are being processed. Use the batch_id to check progress."
+    }
+
+@app.get("/batches/{batch_id}")
+async def get_batch_status(batch_id: str):
+    """Aggregate progress and throughput of a batch, with the task_id of every report"""
+    status = await run_in_threadpool(batch_status, batch_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Batch not found.")
+    return status
+
+async def task_status(task_id: str) -> Optional[dict]:
+    """Where a task stands, or ``None`` if it was never queued (or has expired)"""
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(AnalysisResult.status, AnalysisResult.stage_status, AnalysisResult.stage_errors)
+            .where(AnalysisResult.id == task_id)
+        )).first()
+
+    status = {"task_id": task_id, "state": "queued", "stages": {}, "errors": {}, "progress": 0.0}
+    if row is not None and (row.status or "completed") in FINAL_STATUSES:
+        # The stored row is authoritative once the run is over
+        status.update(
+            state=row.status or "completed",
+            stages=json.loads(row.stage_status) if row.stage_status else {},
+            errors=json.loads(row.stage_errors) if row.stage_errors else {},
+            progress=1.0,
+            result_url=f"/results/{task_id}",
+        )
+        return status
+
+    state, info = await run_in_threadpool(tasks.state, task_id)
+    if row is None and state in (None, "PENDING"):
+        # PENDING means the backend has never seen the id; queued tasks are QUEUED
+        return None
+    if state == "FAILURE":
+        status.update(state="failed", errors={"task": repr(info)}, progress=1.0)
+        return status
+    stages = info.get("stages", {}) if isinstance(info, dict) else {}
+    if row is not None or state in ("STARTED", "PROGRESS"):
+        status["state"] = "running"
+    status["stages"] = stages
+    if stages:
+        status["progress"] = round(sum(1 for s in stages.values() if s in STAGE_DONE) / len(stages), 4)
+    return status
+
+async def wait_for_completion(task_id: str, timeout: float):
+    """Return when the task publishes its completed event or after ``timeout`` seconds"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(timeout, TASK_WAIT_MAX)
+    async with aclosing(event_bus.subscribe(task_id)) as events:
+        # The subscription replays from the start, so a completion that already happened is seen
+        async for item in events:
+            if item is not None and item[1] == "completed":
+                return
+            if loop.time() >= deadline:
+                return
+
+@app.get("/tasks/{task_id}")
+async def get_task_status(task_id: str, wait: float = Query(default=0, ge=0)):
+    """State and per-stage progress of a task. With ``wait`` the request is held
+    until the task finishes or that many seconds pass."""
+    status = await task_status(task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown task_id, or its status has expired.")
+    if wait and status["state"] not in FINAL_STATUSES:
+        await wait_for_completion(task_id, wait)
+        status = await task_status(task_id) or status
+    return status
+
+@app.get("/results")
+async def list_results(
+    limit: int = Query(default=50, ge=1, le=RESULT_LIST_MAX),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    doc_hash: Optional[str] = None,
+    batch_id: Optional[str] = None,
+    created_after: Optional[float] = None,
+    created_before: Optional[float] = None,
+):
+    """Newest results first, without their sections; pass ``next_cursor`` back as
+    ``cursor`` for the next page"""
+    try:
+        statement = list_statement(limit, cursor, status, doc_hash, batch_id, created_after, created_before)
+    except InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(statement)).all()
+    return result_page(rows, limit)
+
 @app.get("/results/{task_id}")
-async def get_analysis_result(task_id: str):
-    db = SessionLocal()
-    result = db.query(AnalysisResult).filter(AnalysisResult.id == task_id).first()
-    db.close()
+async def get_analysis_result(task_id: str, request: Request, wait: float = Query(default=0, ge=0)):
+    # Finished results are served from memory; everything else is read without blocking the loop
+    entry = result_rows.get(task_id)
+    if entry is None and wait:
+        status = await task_status(task_id)
+        if status is not None and status["state"] not in FINAL_STATUSES:
+            await wait_for_completion(task_id, wait)
+    if entry is None:
+        async with AsyncSessionLocal() as db:
+            result = await db.get(AnalysisResult, task_id)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Result not found. Check /tasks/{task_id} to see whether it is still queued.")
+        entry = result_rows.put(result)
+    data, etag = entry
+    # Clients must revalidate, which costs a 304 while nothing changed
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response = JSONResponse(data, headers=headers)
+    PAYLOAD_BYTES.observe(len(response.body), kind="result")
+    return response
+
+@app.get("/results/{task_id}/stream")
+async def stream_analysis_result(task_id: str, request: Request):
+    """Server-Sent Events: section deltas and stage completions as the analysis runs"""
+    last_event_id = request.headers.get("last-event-id")
+
+    async with AsyncSessionLocal() as db:
+        result = await db.get(AnalysisResult, task_id)
+    if result is None:
+        state, _ = await run_in_threadpool(tasks.state, task_id)
+        if state in (None, "PENDING"):
+            # Never queued (or expired): nothing will ever be published for it
+            raise HTTPException(status_code=404, detail="Unknown task_id, or its status has expired.")
+
+    async def finished_result():
+        # The run is over (or its events have expired): send the stored sections in one go
+        statuses = json.loads(result.stage_status) if result.stage_status else {}
+        for name in SECTION_NAMES:
+            content = getattr(result, name)
+            if content:
+                yield format_sse(None, "delta", {"stage": name, "text": content})
+            status = statuses.get(name, "completed" if content else "failed")
+            yield format_sse(None, "stage_completed", {"stage": name, "status": status})
+        errors = json.loads(result.stage_errors) if result.stage_errors else {}
+        yield format_sse(None, "completed", {"status": result.status or "completed", "errors": errors})
+
+    async def live_events():
+        idle_since = asyncio.get_running_loop().time()
+        async for item in event_bus.subscribe(task_id, last_event_id):
+            if await request.is_disconnected():
+                return
+            now = asyncio.get_running_loop().time()
+            if item is None:
+                if now - idle_since > SSE_IDLE_TIMEOUT:
+                    yield format_sse(None, "timeout", {"detail": "No progress received; poll /results instead."})
+                    return
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            idle_since = now
+            event_id, event, data = item
+            yield format_sse(event_id, event, data)
+            if event == "completed":
+                return
+
+    finished = result is not None and result.status not in ("processing",)
+    return StreamingResponse(
+        finished_result() if finished else live_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/results/{task_id}/markers")
+async def get_result_markers(task_id: str):
+    """Lab markers parsed from the report, flagged against their reference ranges without any LLM call"""
+    async with AsyncSessionLocal() as db:
+        result = (await db.execute(select(AnalysisResult.doc_hash).where(AnalysisResult.id == task_id))).first()
     if result is None:
         raise HTTPException(status_code=404, detail="Result not found. The task may still be processing or it failed.")
-    return result
+    # Older documents are parsed and written back on first access, so keep it off the loop
+    table = await run_in_threadpool(load_document_markers, result.doc_hash) if result.doc_hash else None
+    if table is None:
+        raise HTTPException(status_code=404, detail="No extracted report text is stored for this result.")
+    records = table.to_records()
+    return {
+        "result_id": task_id,
+        "count": len(records),
+        "abnormal": sum(1 for r in records if r["status"] in ("low", "high")),
+        "markers": records,
+    }
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return result_cache.stats()
+
+@app.get("/queues")
+async def get_queue_stats():
+    """Depth and recent wait times of the interactive and bulk queues"""
+    return await run_in_threadpool(tasks.stats)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Latency, size and token metrics in the Prometheus text format"""
+    return Response(await run_in_threadpool(registry.render), media_type=CONTENT_TYPE)
 
 async def main():
     """Run the server with proper async handling"""
+    import uvicorn
+
     config = uvicorn.Config(
         "__main__:app",
 
@@ -0,0 +1,231 @@
+import re
+import json
+import math
+from typing import List, Optional
+
+import numpy as np
+
+# Deterministic extraction of lab markers from report text. Nothing here calls a model.
+
+NUM = r"\d+(?:\.\d+)?"
+RANGE = rf"(?:(?P<low>{NUM})\s*-\s*(?P<high>{NUM})|(?P<op>[<>]=?)\s*(?P<bound>{NUM}))"
+
+# "Hemoglobin 14.2 g/dL 13.0 - 17.0" or "Hemoglobin 14.2 H 13.0 - 17.0 g/dL"
+TABULAR_ROW = re.compile(
+    rf"^(?P<name>[A-Za-z][\w ,()/.'\-]*?)\s*:?\s+(?P<value>{NUM})"
+    rf"(?:\s+(?:H|L|High|Low)\b)?(?:\s*(?P<unit>[^\s\d<>][^\s]*))?\s+{RANGE}"
+    rf"(?:\s+(?P<unit2>[^\s\d][^\s]*))?$"
+)
+# Range first, value glued to the unit: "13.00 - 17.00 g/dL15.00" or "40.00 - 80.00 Segmented Neutrophils %60.00"
+RANGE_FIRST = re.compile(rf"^{RANGE}\s*(?P<rest>.*)$")
+GLUED_VALUE = re.compile(rf"^(?:(?P<name>.*\S)\s+)?(?P<unit>\S*?)(?P<value>{NUM})$")
+# Value glued to the name: "0.90Creatinine" or "3.00Globulin(Calculated)  2.0 - 3.5 gm/dL"
+VALUE_FIRST = re.compile(rf"^(?P<value>{NUM})(?P<name>[A-Za-z][^(]*?)\s*(?:\([^)]*\))?(?:\s+(?P<range>[<>\d].*))?$")
+# A line that can only be a marker name
+NAME_LINE = re.compile(r"^[A-Za-z][\w ,/.'&\-]*(?:\([^)]*\))?$")
+METHOD_LINE = re.compile(r"^\(.*\)$")
+
+STATUS_LABELS = np.array(["normal", "low", "high", "unknown"])
+
+
+def _parse_range(match) -> tuple:
+    """Turn a RANGE match into (low, high) with open ends as +/-inf"""
+    if match.group("low") is not None:
+        return float(match.group("low")), float(match.group("high"))
+    bound = float(match.group("bound"))
+    if match.group("op").startswith("<"):
+        return -math.inf, bound
+    return bound, math.inf
+
+
+def _bounds_from_record(record: dict) -> tuple:
+    """Inverse of to_records: a single missing bound means the range is open-ended"""
+    low, high = record["low"], record["high"]
+    if low is None and high is None:
+        return math.nan, math.nan
+    return (-math.inf if low is None else low), (math.inf if high is None else high)
+
+
+def _clean_name(name: str) -> str:
+    return " ".join(name.split()).strip(" ,:")
+
+
+def _split_glued_unit(unit: str, value: str) -> tuple:
+    # "mill/mm34.50" reads as unit "mill/mm" and value "34.50"; the 3 belongs to mm3
+    if unit.endswith("mm") and value.startswith("3") and len(value) > 1 and value[1] != ".":
+        return unit + "3", value[1:]
+    return unit, value
+
+
+class MarkerTable:
+    """Column-oriented table of extracted markers"""
+
+    def __init__(self, names: List[str], values, units: List[Optional[str]], low, high):
+        self.names = list(names)
+        self.units = list(units)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.status = flag_markers(self.values, self.low, self.high)
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def concat(cls, tables: List["MarkerTable"]) -> "MarkerTable":
+        """Stack several tables, e.g. one per page, into one"""
+        tables = list(tables)
+        if not tables:
+            return cls([], [], [], [], [])
+        return cls(
+            [name for t in tables for name in t.names],
+            np.concatenate([t.values for t in tables]),
+            [unit for t in tables for unit in t.units],
+            np.concatenate([t.low for t in tables]),
+            np.concatenate([t.high for t in tables]),
+        )
+
+    def take(self, idx) -> "MarkerTable":
+        """Rows at the given positions, in that order"""
+        idx = np.asarray(idx, dtype=np.intp)
+        return MarkerTable(
+            [self.names[i] for i in idx],
+            self.values[idx],
+            [self.units[i] for i in idx],
+            self.low[idx],
+            self.high[idx],
+        )
+
+    def abnormal(self) -> "MarkerTable":
+        """Markers outside their reference range"""
+        return self.take(np.flatnonzero((self.status == "low") | (self.status == "high")))
+
+    def abnormal_first(self) -> "MarkerTable":
+        """Same markers with out-of-range ones moved to the front"""
+        normal = (self.status != "low") & (self.status != "high")
+        return self.take(np.argsort(normal, kind="stable"))
+
+    def to_records(self) -> List[dict]:
+        def finite(x):
+            return float(x) if np.isfinite(x) else None
+
+        return [
+            {
+                "name": self.names[i],
+                "value": float(self.values[i]),
+                "unit": self.units[i],
+                "low": finite(self.low[i]),
+                "high": finite(self.high[i]),
+                "status": str(self.status[i]),
+            }
+            for i in range(len(self))
+        ]
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_records())
+
+    @classmethod
+    def from_json(cls, data: str) -> "MarkerTable":
+        records = json.loads(data)
+        bounds = [_bounds_from_record(r) for r in records]
+        return cls(
+            [r["name"] for r in records],
+            [r["value"] for r in records],
+            [r["unit"] for r in records],
+            [b[0] for b in bounds],
+            [b[1] for b in bounds],
+        )
+
+    def to_text(self) -> str:
+        """Compact pipe-separated rendering, one marker per line"""
+        lines = ["marker|value|unit|range|status"]
+        for rec in self.to_records():
+            if rec["low"] is None and rec["high"] is None:
+                ref = ""
+            elif rec["low"] is None:
+                ref = f"<{rec['high']:g}"
+            elif rec["high"] is None:
+                ref = f">{rec['low']:g}"
+            else:
+                ref = f"{rec['low']:g}-{rec['high']:g}"
+            lines.append(f"{rec['name']}|{rec['value']:g}|{rec['unit'] or ''}|{ref}|{rec['status']}")
+        return "\n".join(lines)
+
+
+def flag_markers(values: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """Classify every marker against its reference range in one vectorized pass.
+
+    ``low``/``high`` use -inf/+inf for open-ended ranges and NaN when no range
+    was found. Boundary values count as normal.
+    """
+    codes = np.zeros(values.shape, dtype=np.int8)
+    with np.errstate(invalid="ignore"):
+        codes[values < low] = 1
+        codes[values > high] = 2
+    codes[np.isnan(low) & np.isnan(high)] = 3
+    return STATUS_LABELS[codes]
+
+
+def extract_markers(text: str) -> MarkerTable:
+    """Parse marker name, value, unit and reference range out of report text"""
+    names, values, units, lows, highs = [], [], [], [], []
+    last_name = None
+    # Marker whose value came before its name and is still waiting for a range line
+    pending = None
+
+    def emit(name, value, unit, low=math.nan, high=math.nan):
+        names.append(_clean_name(name))
+        values.append(float(value))
+        units.append(unit or None)
+        lows.append(low)
+        highs.append(high)
+
+    def flush():
+        nonlocal pending
+        if pending is not None:
+            emit(*pending)
+            pending = None
+
+    for raw in text.splitlines():
+        line = " ".join(raw.split())
+        if not line or METHOD_LINE.match(line):
+            continue
+
+        match = TABULAR_ROW.match(line)
+        if match:
+            flush()
+            emit(match.group("name"), match.group("value"), match.group("unit") or match.group("unit2"), *_parse_range(match))
+            continue
+
+        match = RANGE_FIRST.match(line)
+        if match:
+            low, high = _parse_range(match)
+            rest = match.group("rest")
+            if pending is not None:
+                name, value, _ = pending
+                pending = None
+                emit(name, value, rest, low, high)
+                continue
+            glued = GLUED_VALUE.match(rest)
+            name = (glued and glued.group("name")) or last_name
+            if glued and name:
+                unit, value = _split_glued_unit(glued.group("unit"), glued.group("value"))
+                emit(name, value, unit, low, high)
+            continue
+
+        match = VALUE_FIRST.match(line)
+        if match:
+            flush()
+            range_part = match.group("range")
+            inline = RANGE_FIRST.match(range_part) if range_part else None
+            if inline:
+                emit(match.group("name"), match.group("value"), inline.group("rest"), *_parse_range(inline))
+            else:
+                pending = (match.group("name"), match.group("value"), None)
+            continue
+
+        if NAME_LINE.match(line):
+            last_name = line
+
+    flush()
+    return MarkerTable(names, values, units, lows, highs)
@@ -0,0 +1,290 @@
+import os
+import re
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "redis" adds up samples from the API and every Celery worker, "memory" only sees this
+# process (enough when analyses run embedded), "none" turns recording off
+METRICS_BACKEND = os.getenv("METRICS_BACKEND", "memory" if os.getenv("TASK_BACKEND") == "embedded" else "redis")
+METRICS_REDIS_URL = os.getenv("METRICS_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+# Seconds samples are buffered in the process before they are sent to Redis
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1.0"))
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MemoryStore:
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, updates: Dict[str, float]):
+        with self._lock:
+            for field, amount in updates.items():
+                self._values[field] = self._values.get(field, 0.0) + amount
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class RedisStore:
+    """All samples in one Redis hash, incremented atomically by every process"""
+
+    key = "metrics"
+
+    def __init__(self, url: str):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def add(self, updates: Dict[str, float]):
+        pipe = self.client.pipeline(transaction=False)
+        for field, amount in updates.items():
+            pipe.hincrbyfloat(self.key, field, amount)
+        pipe.execute()
+
+    def snapshot(self) -> Dict[str, float]:
+        return {field: float(value) for field, value in self.client.hgetall(self.key).items()}
+
+
+class BufferedStore:
+    """Samples added up in memory and sent to Redis by a background thread, so
+    recording them, e.g. from an async handler, never waits on the network"""
+
+    def __init__(self, url: str, interval: float = METRICS_FLUSH_INTERVAL):
+        self.url = url
+        self.interval = interval
+        self._pending = {}
+        self._target = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+
+    def add(self, updates: Dict[str, float]):
+        with self._lock:
+            for field, amount in updates.items():
+                self._pending[field] = self._pending.get(field, 0.0) + amount
+            # Started per process: a forked Celery worker doesn't inherit the thread
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._flush_forever, name="metrics-flush", daemon=True).start()
+                atexit.register(self.flush)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def target(self):
+        """Redis, or this process's memory when Redis was unavailable on first use"""
+        with self._connect_lock:
+            if self._target is None:
+                try:
+                    store = RedisStore(self.url)
+                    store.client.ping()
+                    self._target = store
+                except Exception as exc:
+                    logger.warning("Redis metrics store unavailable (%s); keeping metrics per process instead", exc)
+                    self._target = MemoryStore()
+            return self._target
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            self.target().add(pending)
+        except Exception as exc:
+            logger.warning("Could not send metrics: %s", exc)
+            # Keep them for the next flush; the buffer only grows with the number of series
+            with self._lock:
+                for field, amount in pending.items():
+                    self._pending[field] = self._pending.get(field, 0.0) + amount
+
+    def snapshot(self) -> Dict[str, float]:
+        self.flush()
+        return self.target().snapshot()
+
+
+class NullStore:
+    def add(self, updates: Dict[str, float]):
+        pass
+
+    def snapshot(self) -> Dict[str, float]:
+        return {}
+
+
+def create_store(backend: str = METRICS_BACKEND):
+    if backend == "none":
+        return NullStore()
+    if backend == "redis":
+        # Connects, or falls back to memory, on the first flush rather than here
+        return BufferedStore(METRICS_REDIS_URL)
+    return MemoryStore()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide sample store, created on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = create_store()
+    return _store
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name: str, labels: Tuple[Tuple[str, object], ...]) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _record(updates: Dict[str, float]):
+    # Metrics must never fail the work they measure
+    try:
+        get_store().add(updates)
+    except Exception as exc:
+        logger.warning("Could not record metrics: %s", exc)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _labels(self, labels: dict) -> Tuple[Tuple[str, object], ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((key, labels[key]) for key in self.labelnames)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        _record({_sample(self.name, self._labels(labels)): amount})
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        base = self._labels(labels)
+        updates = {_sample(f"{self.name}_bucket", base + (("le", repr(float(le))),)): 1 for le in self.buckets if value <= le}
+        updates[_sample(f"{self.name}_bucket", base + (("le", "+Inf"),))] = 1
+        updates[_sample(f"{self.name}_sum", base)] = value
+        updates[_sample(f"{self.name}_count", base)] = 1
+        _record(updates)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=SECONDS_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def _add(self, metric: Metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Everything recorded so far in the Prometheus text format"""
+        grouped = {name: [] for name in self.metrics}
+        for field, value in get_store().snapshot().items():
+            base = field.split("{", 1)[0]
+            for suffix in ("_bucket", "_count", "_sum", ""):
+                name = base[: len(base) - len(suffix)] if suffix and base.endswith(suffix) else base
+                if name in grouped:
+                    grouped[name].append((field, value))
+                    break
+        lines = []
+        for name, samples in grouped.items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for field, value in sorted(samples, key=_sort_key):
+                lines.append(f"{field} {int(value) if value.is_integer() else repr(value)}")
+        return "\n".join(lines) + "\n"
+
+
+LE_LABEL = re.compile(r',?le="([^"]+)"')
+
+
+def _sort_key(sample):
+    """Buckets of one series together and in increasing order, then its _sum and _count.
+
+    >>> import metrics
+    >>> metrics._store = MemoryStore()
+    >>> demo = Registry()
+    >>> demo.histogram("demo_seconds", "Unlabelled histogram", buckets=(1, 5)).observe(2)
+    >>> print(demo.render(), end="")
+    # HELP demo_seconds Unlabelled histogram
+    # TYPE demo_seconds histogram
+    demo_seconds_bucket{le="5.0"} 1
+    demo_seconds_bucket{le="+Inf"} 1
+    demo_seconds_sum 2
+    demo_seconds_count 1
+    """
+    field = sample[0]
+    name, _, labels = field.partition("{")
+    le = LE_LABEL.search(labels)
+    # The series is the labels without the closing brace and le, so a bucket and
+    # the _sum and _count beside it compare equal even when le is the only label
+    series = LE_LABEL.sub("", labels.rstrip("}")).strip(",")
+    return series, name.endswith("_count"), name.endswith("_sum"), float(le.group(1)) if le else 0.0
+
+
+registry = Registry()
+
+UPLOAD_SECONDS = registry.histogram("upload_seconds", "Time to stream an upload to disk while hashing it")
+PAYLOAD_BYTES = registry.histogram("payload_bytes", "Size of uploaded reports and of results served", ("kind",), BYTES_BUCKETS)
+QUEUE_WAIT_SECONDS = registry.histogram("queue_wait_seconds", "Time a task spent queued before a worker started it", ("queue",))
+ANALYSIS_SECONDS = registry.histogram("analysis_seconds", "Worker time for one analysis, by outcome", ("status",))
+STAGE_SECONDS = registry.histogram("analysis_stage_seconds", "Time spent in each analysis step", ("stage",))
+STAGE_OUTCOMES = registry.counter("analysis_stage_total", "Analysis steps by outcome", ("stage", "status"))
+STAGE_TOKENS = registry.counter("analysis_tokens_total", "Model tokens spent by each analysis step", ("stage", "direction"))
+DB_WRITE_SECONDS = registry.histogram("db_write_seconds", "Time to write analysis rows", ("operation",))
+LLM_REQUEST_SECONDS = registry.histogram("llm_request_seconds", "Model calls including rate-limit waits and retries", ("mode",))
+LLM_CLIENT_EVENTS = registry.counter("llm_client_events_total", "Model calls sent, retried, failed or coalesced", ("event",))
+LLM_RATE_LIMITED_SECONDS = registry.counter("llm_rate_limited_seconds_total", "Time model calls waited for the rate limiter")
+LLM_TOKENS = registry.counter("llm_tokens_total", "Model tokens reported by the API", ("direction",))
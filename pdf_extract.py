@@ -0,0 +1,189 @@
+import os
+import re
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, List, Optional, Tuple
+
+
+# Documents with at least this many pages are extracted in a process pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+# Extraction processes; 0 or 1 always extracts in the calling process
+PDF_EXTRACT_PROCESSES = int(os.getenv("PDF_EXTRACT_PROCESSES", str(min(4, os.cpu_count() or 1))))
+# Pages handed to one extraction process at a time
+PDF_PAGES_PER_JOB = int(os.getenv("PDF_PAGES_PER_JOB", "8"))
+# Total extracted text kept in the per-process cache, and the largest single document cached
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PDF_CACHE_MAX_DOC_BYTES = int(os.getenv("PDF_CACHE_MAX_DOC_BYTES", str(8 * 1024 * 1024)))
+# File hashes remembered per process, least recently used dropped first
+PDF_HASH_CACHE_MAX_ENTRIES = 4096
+# The API and workers run threads (event bus, metrics flush, task pool) that may hold
+# locks at fork time, so extraction processes are never plain forks of them
+PDF_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+BLANK_LINES = re.compile(r"\n{2,}")
+
+_pool = None
+_pool_lock = threading.Lock()
+_cache_lock = threading.Lock()
+# (path, size, mtime) -> sha256, so unchanged files aren't re-hashed; least recently used first
+_hashes = OrderedDict()
+# sha256 -> (pages, size in bytes), least recently used first
+_pages = OrderedDict()
+_cached_bytes = 0
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash a file without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_whitespace(text: str) -> str:
+    """Collapse runs of blank lines into a single newline in one linear pass"""
+    return BLANK_LINES.sub("\n", text)
+
+
+def _stat_key(path: str) -> Tuple[str, int, int]:
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def _content_hash(path: str) -> str:
+    key = _stat_key(path)
+    with _cache_lock:
+        cached = _hashes.get(key)
+        if cached is not None:
+            _hashes.move_to_end(key)
+    if cached is None:
+        cached = file_sha256(path)
+        with _cache_lock:
+            _hashes[key] = cached
+            while len(_hashes) > PDF_HASH_CACHE_MAX_ENTRIES:
+                _hashes.popitem(last=False)
+    return cached
+
+
+def _cache_get(doc_hash: str) -> Optional[List[str]]:
+    with _cache_lock:
+        item = _pages.get(doc_hash)
+        if item is None:
+            return None
+        _pages.move_to_end(doc_hash)
+        return item[0]
+
+
+def _cache_put(doc_hash: str, pages: List[str], size: int):
+    global _cached_bytes
+    with _cache_lock:
+        if doc_hash in _pages:
+            return
+        _pages[doc_hash] = (pages, size)
+        _cached_bytes += size
+        while _cached_bytes > PDF_CACHE_MAX_BYTES and _pages:
+            _, (_, old_size) = _pages.popitem(last=False)
+            _cached_bytes -= old_size
+
+
+def clear_cache():
+    global _cached_bytes
+    with _cache_lock:
+        _hashes.clear()
+        _pages.clear()
+        _cached_bytes = 0
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if PDF_EXTRACT_PROCESSES <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_PROCESSES, mp_context=multiprocessing.get_context(PDF_START_METHOD)
+            )
+    return _pool
+
+
+def _disable_pool():
+    global PDF_EXTRACT_PROCESSES, _pool
+    with _pool_lock:
+        PDF_EXTRACT_PROCESSES = 0
+        _pool = None
+
+
+def _extract_range(path: str, start: int, stop: int) -> List[str]:
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _iter_extracted(path: str) -> Iterator[str]:
+    # Imported on first use to keep API and worker start-up fast
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    page_count = len(reader.pages)
+    pool = _get_pool() if page_count >= PDF_PARALLEL_MIN_PAGES else None
+    futures = []
+    if pool is not None:
+        try:
+            futures.append(pool.submit(_extract_range, path, 0, min(PDF_PAGES_PER_JOB, page_count)))
+        except (AssertionError, OSError, BrokenProcessPool):
+            # Daemonic processes (e.g. Celery prefork children) can't start their own pool
+            _disable_pool()
+            pool = None
+    if pool is None:
+        for page in reader.pages:
+            yield page.extract_text() or ""
+        return
+
+    # Keep a bounded number of jobs queued and yield pages in document order
+    max_in_flight = max(1, PDF_EXTRACT_PROCESSES * 2)
+    try:
+        for start in range(PDF_PAGES_PER_JOB, page_count, PDF_PAGES_PER_JOB):
+            futures.append(pool.submit(_extract_range, path, start, min(start + PDF_PAGES_PER_JOB, page_count)))
+            if len(futures) >= max_in_flight:
+                yield from futures.pop(0).result()
+        while futures:
+            yield from futures.pop(0).result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def iter_pages(path: str, doc_hash: Optional[str] = None) -> Iterator[str]:
+    """Yield the text of each page, served from the cache when the file is unchanged.
+
+    Pass ``doc_hash`` when the caller already hashed the file.
+    """
+    doc_hash = doc_hash or _content_hash(path)
+    cached = _cache_get(doc_hash)
+    if cached is not None:
+        yield from cached
+        return
+
+    pages, size = [], 0
+    for text in _iter_extracted(path):
+        if pages is not None:
+            size += len(text)
+            pages.append(text)
+            if size > PDF_CACHE_MAX_DOC_BYTES:
+                # Too big to cache; stop holding on to pages
+                pages = None
+        yield text
+    if pages is not None:
+        _cache_put(doc_hash, pages, size)
+
+
+def read_pdf_text(path: str, normalize: bool = False) -> str:
+    """Whole document as one string, one page per line block"""
+    text = "".join(page + "\n" for page in iter_pages(path))
+    return normalize_whitespace(text) if normalize else text
@@ -0,0 +1,147 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# "concurrent" runs the analysis stages on a shared thread pool, "sequential" runs them one by one
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "concurrent")
+# Maximum number of stages running at once in this worker process (shared by all tasks)
+ANALYSIS_MAX_WORKERS = int(os.getenv("ANALYSIS_MAX_WORKERS", "4"))
+# Seconds a single stage may run before it is recorded as timed out
+ANALYSIS_STAGE_TIMEOUT = float(os.getenv("ANALYSIS_STAGE_TIMEOUT", "120"))
+# "auto" accepts reports with enough lab markers and asks the model a yes/no question about
+# the rest, "heuristic" rejects them outright, "model" always asks, "off" runs every stage
+VERIFICATION_GATE = os.getenv("VERIFICATION_GATE", "auto")
+# Lab markers found in the text that are enough to accept a report without a model call
+VERIFICATION_GATE_MIN_MARKERS = int(os.getenv("VERIFICATION_GATE_MIN_MARKERS", "3"))
+# Stream model output so sections can be followed on /results/{task_id}/stream as they are written
+ANALYSIS_STREAMING = os.getenv("ANALYSIS_STREAMING", "true").lower() in ("1", "true", "yes")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the per-process stage pool, creating it on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=ANALYSIS_MAX_WORKERS,
+                thread_name_prefix="analysis-stage",
+            )
+    return _executor
+
+
+class StageRejected(Exception):
+    """Raised by a gate stage to stop every stage that depends on it"""
+
+
+def _describe(exc: BaseException) -> str:
+    return f"{type(exc).__name__}: {exc}"
+
+
+def _run_graph(
+    stages: Dict[str, Callable[[], str]],
+    requires: Dict[str, Tuple[str, ...]],
+    timeout: float,
+    sequential: bool,
+    on_timeout: Optional[Callable[[str], None]] = None,
+) -> Tuple[Dict[str, Optional[str]], Dict[str, str], Dict[str, str]]:
+    results = {name: None for name in stages}
+    errors, statuses = {}, {}
+    started, futures, submitted = {}, {}, set()
+    executor = None if sequential else get_executor()
+
+    def timed(name, fn):
+        # The timeout counts from when the stage starts, not from when it was queued
+        started[name] = time.monotonic()
+        return fn()
+
+    def finish(name, call):
+        try:
+            results[name] = call()
+            statuses[name] = "completed"
+        except StageRejected as exc:
+            results[name] = str(exc)
+            statuses[name] = "rejected"
+        except Exception as exc:
+            errors[name] = _describe(exc)
+            statuses[name] = "failed"
+
+    def schedule():
+        """Start every stage whose dependencies completed and skip those whose didn't"""
+        new = set()
+        progressed = True
+        while progressed:
+            progressed = False
+            for name, fn in stages.items():
+                if name in statuses or name in submitted:
+                    continue
+                deps = requires.get(name, ())
+                if any(statuses.get(dep, "completed") != "completed" for dep in deps):
+                    statuses[name] = "skipped"
+                    progressed = True
+                elif all(statuses.get(dep) == "completed" for dep in deps):
+                    submitted.add(name)
+                    if executor is None:
+                        finish(name, fn)
+                        progressed = True
+                    else:
+                        future = executor.submit(timed, name, fn)
+                        futures[future] = name
+                        new.add(future)
+        return new
+
+    pending = schedule()
+    while pending:
+        done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+        for future in done:
+            finish(futures[future], future.result)
+
+        now = time.monotonic()
+        timed_out = False
+        for future in list(pending):
+            name = futures[future]
+            if name in started and now - started[name] > timeout:
+                # A running thread can't be killed; abandon it and record the timeout
+                future.cancel()
+                pending.discard(future)
+                errors[name] = f"TimeoutError: stage exceeded {timeout:g}s"
+                statuses[name] = "timeout"
+                timed_out = True
+                if on_timeout is not None:
+                    on_timeout(name)
+
+        if done or timed_out:
+            pending |= schedule()
+
+    return results, errors, statuses
+
+
+def run_stages(
+    stages: Dict[str, Callable[[], str]],
+    requires: Optional[Dict[str, Iterable[str]]] = None,
+    mode: Optional[str] = None,
+    timeout: Optional[float] = None,
+    on_timeout: Optional[Callable[[str], None]] = None,
+) -> Tuple[Dict[str, Optional[str]], Dict[str, str], Dict[str, str]]:
+    """Run analysis stages as a small dependency graph and collect their outputs.
+
+    ``requires`` maps a stage to the stages it waits for; dependencies that are
+    not part of ``stages`` are treated as met. Independent stages run side by
+    side in concurrent mode. Returns ``(results, errors, statuses)`` where each
+    status is ``completed``, ``failed``, ``timeout``, ``rejected`` (the stage
+    raised ``StageRejected``; its result is the reason) or ``skipped`` (a
+    dependency did not complete, so the stage never ran). Failed and timed out
+    stages have ``None`` in ``results`` and a short description in ``errors``.
+    ``on_timeout`` is called with the name of each stage as it is abandoned.
+    """
+    mode = mode or ANALYSIS_MODE
+    timeout = ANALYSIS_STAGE_TIMEOUT if timeout is None else timeout
+    requires = {
+        name: tuple(dep for dep in (requires or {}).get(name, ()) if dep in stages)
+        for name in stages
+    }
+    return _run_graph(stages, requires, timeout, sequential=mode == "sequential", on_timeout=on_timeout)
@@ -0,0 +1,113 @@
+import os
+import re
+import math
+import threading
+from collections import Counter
+from typing import Optional
+
+from markers import MarkerTable
+
+# "text" sends the normalized report text to the query stages, "markers" sends the
+# compact marker table instead when enough markers were extracted. Verification
+# always sees the text because it has to judge the document itself.
+PROMPT_REPORT_MODE = os.getenv("PROMPT_REPORT_MODE", "text")
+# Fewest extracted markers for the marker table to replace the text
+PROMPT_MIN_MARKERS = int(os.getenv("PROMPT_MIN_MARKERS", "5"))
+# Default token budget for a whole stage prompt; override per stage with
+# PROMPT_TOKEN_BUDGET_<STAGE>, e.g. PROMPT_TOKEN_BUDGET_MEDICAL_ANALYSIS
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+# Lines repeated at least this often (page headers, footers, addresses) are kept once
+PROMPT_REPEAT_THRESHOLD = int(os.getenv("PROMPT_REPEAT_THRESHOLD", "3"))
+# Shorter repeated lines are kept every time: they are usually result values
+# ("Nil", "Negative") or test names rather than boilerplate
+PROMPT_REPEAT_MIN_CHARS = int(os.getenv("PROMPT_REPEAT_MIN_CHARS", "20"))
+
+# Rough characters-per-token ratio used when the model doesn't report usage
+CHARS_PER_TOKEN = 4
+# Stages that only need a glance at the report get a smaller default budget
+STAGE_TOKEN_BUDGETS = {"gate": 1500}
+TRUNCATION_NOTE = "\n[... report truncated to fit the token budget ...]"
+
+# Page numbers, barcodes and lines with nothing but punctuation
+NOISE_LINE = re.compile(r"^(?:page \d+ of \d+|\*[\w-]+\*|[\W_]+)$", re.IGNORECASE)
+# Repeated lines with a digit may be values or reference ranges and are never dropped
+HAS_DIGIT = re.compile(r"\d")
+
+_usage = threading.local()
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def stage_budget(stage: str) -> int:
+    default = STAGE_TOKEN_BUDGETS.get(stage, PROMPT_TOKEN_BUDGET)
+    return int(os.getenv(f"PROMPT_TOKEN_BUDGET_{stage.upper()}", str(default)))
+
+
+def is_boilerplate(line: str, count: int) -> bool:
+    """Whether a line seen ``count`` times is header/footer text that can be kept once"""
+    return count >= PROMPT_REPEAT_THRESHOLD and len(line) >= PROMPT_REPEAT_MIN_CHARS and not HAS_DIGIT.search(line)
+
+
+def normalize_report_text(text: str) -> str:
+    r"""Collapse whitespace and drop noise and repeated boilerplate lines in one pass.
+
+    Repeated values stay next to their tests:
+
+    >>> normalize_report_text("Glucose\nNil\nKetones\nNil\nBlood\nNil\nProtein\nTrace")
+    'Glucose\nNil\nKetones\nNil\nBlood\nNil\nProtein\nTrace'
+    >>> footer = "Please correlate clinically with patient history"
+    >>> normalize_report_text("\n".join(["Haemoglobin 13.5 g/dL", footer] * 3))
+    'Haemoglobin 13.5 g/dL\nPlease correlate clinically with patient history\nHaemoglobin 13.5 g/dL\nHaemoglobin 13.5 g/dL'
+    """
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    counts = Counter(lines)
+    seen = set()
+    out = []
+    for line in lines:
+        if not line or NOISE_LINE.match(line):
+            continue
+        if is_boilerplate(line, counts[line]):
+            if line in seen:
+                continue
+            seen.add(line)
+        out.append(line)
+    return "\n".join(out)
+
+
+def compact_report(text: str, markers: Optional[MarkerTable], mode: str = None) -> str:
+    """Report material for the query stages: marker table or normalized text"""
+    mode = mode or PROMPT_REPORT_MODE
+    if mode == "markers" and markers is not None and len(markers) >= PROMPT_MIN_MARKERS:
+        return "Extracted lab markers, out-of-range first:\n" + markers.abnormal_first().to_text()
+    return text
+
+
+def fit_to_budget(text: str, max_tokens: int) -> str:
+    """Cut text at a line boundary so it fits in roughly max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max(0, max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_NOTE))
+    cut = text.rfind("\n", 0, limit)
+    return text[:cut if cut > 0 else limit] + TRUNCATION_NOTE
+
+
+def build_prompt(stage: str, template: str, content: str, **fields) -> str:
+    """Fill a stage template, trimming the report so the prompt stays within the stage budget"""
+    overhead = estimate_tokens(template.format(content="", **fields))
+    report = fit_to_budget(content, max(0, stage_budget(stage) - overhead))
+    return template.format(content=report, **fields)
+
+
+def record_usage(input_tokens: int, output_tokens: int):
+    """Add token counts for a model call made on the current thread"""
+    _usage.input = getattr(_usage, "input", 0) + input_tokens
+    _usage.output = getattr(_usage, "output", 0) + output_tokens
+
+
+def take_usage() -> dict:
+    """Return and reset the token counts recorded on the current thread"""
+    usage = {"input_tokens": getattr(_usage, "input", 0), "output_tokens": getattr(_usage, "output", 0)}
+    _usage.input = _usage.output = 0
+    return usage
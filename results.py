@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import base64
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import select, delete, func, and_, or_, exists
+
+from database import SessionLocal, AnalysisResult, BatchRecord, DocumentRecord, SectionRecord, FINAL_STATUSES
+from cache import result_rows
+
+load_dotenv()
+
+# Finished results and batches older than this many days are deleted; 0 keeps them.
+# Stored documents and sections go once no remaining result uses them.
+RESULT_RETENTION_DAYS = float(os.getenv("RESULT_RETENTION_DAYS", "0"))
+# Most finished results kept; the oldest beyond it are deleted. 0 disables
+RESULT_RETENTION_MAX_ROWS = int(os.getenv("RESULT_RETENTION_MAX_ROWS", "0"))
+# Seconds between purges run by the API
+RESULT_RETENTION_INTERVAL = float(os.getenv("RESULT_RETENTION_INTERVAL", "3600"))
+# Largest page of GET /results
+RESULT_LIST_MAX = int(os.getenv("RESULT_LIST_MAX", "200"))
+# Rows deleted per transaction, so a large purge never holds the database for long
+PURGE_BATCH_SIZE = 500
+# Unused documents and sections younger than this are kept, in case an analysis
+# that is just starting is about to use them
+ORPHAN_GRACE_SECONDS = 3600
+
+# Columns returned by the listing; section bodies are left in the table
+LIST_COLUMNS = (
+    AnalysisResult.id,
+    AnalysisResult.query,
+    AnalysisResult.status,
+    AnalysisResult.doc_hash,
+    AnalysisResult.batch_id,
+    AnalysisResult.input_tokens,
+    AnalysisResult.output_tokens,
+    AnalysisResult.created_at,
+    AnalysisResult.completed_at,
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: float, result_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, result_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        created_at, result_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(created_at), str(result_id)
+    except Exception:
+        raise InvalidCursor("cursor is not one returned by this endpoint")
+
+
+def list_statement(
+    limit: int,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    doc_hash: Optional[str] = None,
+    batch_id: Optional[str] = None,
+    created_after: Optional[float] = None,
+    created_before: Optional[float] = None,
+):
+    """Newest-first page of results after ``cursor``, one row more than ``limit``
+    so the caller can tell whether another page follows"""
+    statement = select(*LIST_COLUMNS)
+    if cursor:
+        created_at, result_id = decode_cursor(cursor)
+        # Keyset pagination: stable while rows are added, and never scans skipped pages
+        statement = statement.where(or_(
+            AnalysisResult.created_at < created_at,
+            and_(AnalysisResult.created_at == created_at, AnalysisResult.id < result_id),
+        ))
+    if status:
+        statement = statement.where(AnalysisResult.status == status)
+    if doc_hash:
+        statement = statement.where(AnalysisResult.doc_hash == doc_hash)
+    if batch_id:
+        statement = statement.where(AnalysisResult.batch_id == batch_id)
+    if created_after is not None:
+        statement = statement.where(AnalysisResult.created_at >= created_after)
+    if created_before is not None:
+        statement = statement.where(AnalysisResult.created_at < created_before)
+    return statement.order_by(AnalysisResult.created_at.desc(), AnalysisResult.id.desc()).limit(limit + 1)
+
+
+def result_page(rows, limit: int) -> Dict:
+    """``{"items", "next_cursor"}`` from the rows of ``list_statement``"""
+    items = [dict(row._mapping) for row in rows[:limit]]
+    last = items[-1] if len(rows) > limit else None
+    return {"items": items, "next_cursor": encode_cursor(last["created_at"], last["id"]) if last else None}
+
+
+def retention_enabled() -> bool:
+    return RESULT_RETENTION_DAYS > 0 or RESULT_RETENTION_MAX_ROWS > 0
+
+
+def _finished():
+    # Rows written before the status column existed are complete
+    return or_(AnalysisResult.status.in_(FINAL_STATUSES), AnalysisResult.status.is_(None))
+
+
+def _delete_results(db, statement) -> int:
+    """Delete the results whose ids ``statement`` selects"""
+    ids = db.execute(statement).scalars().all()
+    if ids:
+        db.execute(delete(AnalysisResult).where(AnalysisResult.id.in_(ids)))
+        db.commit()
+        # Other API processes drop theirs within RESULT_ROW_CACHE_TTL; result cache
+        # entries pointing at a deleted row are dropped the next time they're looked up
+        for result_id in ids:
+            result_rows.invalidate(result_id)
+    return len(ids)
+
+
+def _delete_older(db, model, cutoff: float, *conditions) -> int:
+    removed = 0
+    key = model.__mapper__.primary_key[0]
+    while True:
+        statement = select(key).where(model.created_at < cutoff, *conditions).limit(PURGE_BATCH_SIZE)
+        keys = db.execute(statement).scalars().all()
+        if not keys:
+            return removed
+        db.execute(delete(model).where(key.in_(keys)))
+        db.commit()
+        removed += len(keys)
+
+
+def _unused(model):
+    # Documents and sections are shared by every result for the same report
+    return ~exists().where(AnalysisResult.doc_hash == model.doc_hash)
+
+
+def purge_results(
+    max_age_days: float = RESULT_RETENTION_DAYS,
+    max_rows: int = RESULT_RETENTION_MAX_ROWS,
+) -> Dict[str, int]:
+    """Delete finished results older than ``max_age_days`` and the oldest beyond
+    ``max_rows``, batches past the age limit, and the documents and sections no
+    remaining result refers to. Results still processing are never touched.
+    Returns the rows removed per table."""
+    removed = {"results": 0, "batches": 0, "documents": 0, "sections": 0}
+    db = SessionLocal()
+    try:
+        if max_age_days > 0:
+            cutoff = time.time() - max_age_days * 86400
+            old = select(AnalysisResult.id).where(_finished(), AnalysisResult.created_at < cutoff).limit(PURGE_BATCH_SIZE)
+            while True:
+                count = _delete_results(db, old)
+                removed["results"] += count
+                if count < PURGE_BATCH_SIZE:
+                    break
+            removed["batches"] = _delete_older(db, BatchRecord, cutoff)
+
+        if max_rows > 0:
+            excess = db.execute(select(func.count()).select_from(AnalysisResult).where(_finished())).scalar() - max_rows
+            oldest = (
+                select(AnalysisResult.id)
+                .where(_finished())
+                .order_by(AnalysisResult.created_at, AnalysisResult.id)
+            )
+            while excess > 0:
+                count = _delete_results(db, oldest.limit(min(excess, PURGE_BATCH_SIZE)))
+                if not count:
+                    break
+                removed["results"] += count
+                excess -= count
+
+        unused_before = time.time() - ORPHAN_GRACE_SECONDS
+        removed["documents"] = _delete_older(db, DocumentRecord, unused_before, _unused(DocumentRecord))
+        removed["sections"] = _delete_older(db, SectionRecord, unused_before, _unused(SectionRecord))
+    finally:
+        db.close()
+    return removed
+
+
+if __name__ == "__main__":
+    # One-off purge, e.g. from cron when the API's own schedule isn't wanted
+    print(purge_results())
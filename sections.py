@@ -0,0 +1,116 @@
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from cache import query_hash
+from database import SessionLocal, DocumentRecord, SectionRecord
+from markers import MarkerTable, extract_markers
+
+# Sections that depend only on the document
+DOCUMENT_SECTIONS = ("verification",)
+# Sections that depend on the document and the user query
+QUERY_SECTIONS = ("medical_analysis", "nutrition_plan", "exercise_plan")
+
+
+def _section_query_hash(section: str, query: str) -> str:
+    return "" if section in DOCUMENT_SECTIONS else query_hash(query)
+
+
+def load_document_text(doc_hash: str) -> Optional[str]:
+    """Return the stored extracted text for a document, if any"""
+    db = SessionLocal()
+    try:
+        record = db.get(DocumentRecord, doc_hash)
+        return record.content if record else None
+    finally:
+        db.close()
+
+
+def save_document_text(doc_hash: str, content: str, markers: Optional[str] = None, map_reduced: bool = False):
+    db = SessionLocal()
+    try:
+        db.add(DocumentRecord(
+            doc_hash=doc_hash,
+            content=content,
+            markers=markers,
+            map_reduced=map_reduced,
+            created_at=time.time(),
+        ))
+        db.commit()
+    except IntegrityError:
+        # Another worker stored the same document first
+        db.rollback()
+    finally:
+        db.close()
+
+
+def load_document_markers(doc_hash: str) -> Optional[MarkerTable]:
+    """Return the marker table for a stored document, parsing older rows on demand"""
+    db = SessionLocal()
+    try:
+        record = db.get(DocumentRecord, doc_hash)
+        if record is None:
+            return None
+        if record.markers is not None:
+            return MarkerTable.from_json(record.markers)
+        table = extract_markers(record.content)
+        record.markers = table.to_json()
+        db.commit()
+        return table
+    finally:
+        db.close()
+
+
+def load_sections(doc_hash: str, query: str) -> Dict[str, Tuple[str, str]]:
+    """Return ``{section: (section_id, content)}`` for sections already computed"""
+    wanted = {section: _section_query_hash(section, query) for section in DOCUMENT_SECTIONS + QUERY_SECTIONS}
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(SectionRecord)
+            .filter(SectionRecord.doc_hash == doc_hash)
+            .filter(SectionRecord.query_hash.in_(set(wanted.values())))
+            .all()
+        )
+        return {
+            row.section: (row.id, row.content)
+            for row in rows
+            if wanted.get(row.section) == row.query_hash
+        }
+    finally:
+        db.close()
+
+
+def save_sections(doc_hash: str, query: str, sections: Dict[str, str]) -> Dict[str, str]:
+    """Store freshly generated sections and return ``{section: section_id}``"""
+    refs = {}
+    db = SessionLocal()
+    try:
+        for section, content in sections.items():
+            record = SectionRecord(
+                id=str(uuid.uuid4()),
+                doc_hash=doc_hash,
+                query_hash=_section_query_hash(section, query),
+                section=section,
+                content=content,
+                created_at=time.time(),
+            )
+            db.add(record)
+            try:
+                db.commit()
+                refs[section] = record.id
+            except IntegrityError:
+                # A concurrent task produced this section; link to its copy instead
+                db.rollback()
+                existing = (
+                    db.query(SectionRecord.id)
+                    .filter_by(doc_hash=doc_hash, query_hash=record.query_hash, section=section)
+                    .first()
+                )
+                if existing is not None:
+                    refs[section] = existing.id
+        return refs
+    finally:
+        db.close()
@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+import threading
+from typing import Iterable, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "redis" shares concurrency limits across workers, "local" applies them per process
+SLOTS_BACKEND = os.getenv("SLOTS_BACKEND", "redis")
+SLOTS_REDIS_URL = os.getenv("SLOTS_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+# Seconds a slot is held before it is presumed abandoned by a crashed worker
+SLOT_TTL = float(os.getenv("SLOT_TTL", "1800"))
+# Seconds a task that found no free slot waits in its queue before asking again
+SLOT_RETRY_DELAY = float(os.getenv("SLOT_RETRY_DELAY", "5"))
+
+# (pool key, limit) pairs a task must hold at once
+Claims = Iterable[Tuple[str, int]]
+
+
+class LocalSlots:
+    """Counting semaphores for one process"""
+
+    def __init__(self):
+        self._holders = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, holder: str, limit: int) -> bool:
+        with self._lock:
+            holders = self._holders.setdefault(key, set())
+            if holder in holders or len(holders) < limit:
+                holders.add(holder)
+                return True
+            return False
+
+    def release(self, key: str, holder: str):
+        with self._lock:
+            self._holders.get(key, set()).discard(holder)
+
+    def in_use(self, key: str) -> int:
+        with self._lock:
+            return len(self._holders.get(key, ()))
+
+
+# Holders are scored by lease expiry so slots of crashed workers free themselves.
+# Returns 1 when the slot is held.
+REDIS_SLOTS_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZSCORE', KEYS[1], ARGV[4]) or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+  redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[4])
+  redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[3]))
+  return 1
+end
+return 0
+"""
+
+
+class RedisSlots:
+    """Counting semaphores shared by every worker talking to the same Redis"""
+
+    prefix = "slots:"
+
+    def __init__(self, url: str, ttl: float):
+        import redis
+
+        self.ttl_ms = int(ttl * 1000)
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(REDIS_SLOTS_SCRIPT)
+
+    def acquire(self, key: str, holder: str, limit: int) -> bool:
+        now_ms = int(time.time() * 1000)
+        return bool(self.script(keys=[self.prefix + key], args=[now_ms, limit, self.ttl_ms, holder]))
+
+    def release(self, key: str, holder: str):
+        self.client.zrem(self.prefix + key, holder)
+
+    def in_use(self, key: str) -> int:
+        return self.client.zcount(self.prefix + key, int(time.time() * 1000), "+inf")
+
+
+def create_slots(backend: str = SLOTS_BACKEND):
+    if backend == "redis":
+        try:
+            slots = RedisSlots(SLOTS_REDIS_URL, SLOT_TTL)
+            slots.client.ping()
+            return slots
+        except Exception as exc:
+            logger.warning("Redis concurrency slots unavailable (%s); limiting per process instead", exc)
+    return LocalSlots()
+
+
+_slots = None
+_slots_lock = threading.Lock()
+
+
+def get_slots():
+    """Process-wide concurrency limiter, created on first use"""
+    global _slots
+    with _slots_lock:
+        if _slots is None:
+            _slots = create_slots()
+    return _slots
+
+
+def acquire_all(holder: str, claims: Claims) -> bool:
+    """Take a slot in every pool, or none of them. Pools with a limit of 0 or less are unlimited."""
+    slots = get_slots()
+    held = []
+    for key, limit in claims:
+        if limit <= 0:
+            continue
+        if not slots.acquire(key, holder, limit):
+            for taken in held:
+                slots.release(taken, holder)
+            return False
+        held.append(key)
+    return True
+
+
+def release_all(holder: str, claims: Claims):
+    slots = get_slots()
+    for key, limit in claims:
+        if limit > 0:
+            slots.release(key, holder)
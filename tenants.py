@@ -0,0 +1,58 @@
+import os
+import hashlib
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Analyses one tenant may have running at once across all workers; 0 disables the quota
+TENANT_MAX_CONCURRENCY = int(os.getenv("TENANT_MAX_CONCURRENCY", "4"))
+# Per-tenant overrides as "tenant_id=limit,tenant_id=limit", using the ids the API reports
+TENANT_QUOTAS = os.getenv("TENANT_QUOTAS", "")
+# Analyses requests without an API key may have running at once; 0 (the default)
+# leaves them unlimited, since deployments without keys send everything this way
+ANONYMOUS_MAX_CONCURRENCY = int(os.getenv("ANONYMOUS_MAX_CONCURRENCY", "0"))
+
+ANONYMOUS_TENANT = "anonymous"
+
+
+def parse_quotas(spec: str) -> Dict[str, int]:
+    quotas = {}
+    for item in spec.split(","):
+        name, sep, limit = item.partition("=")
+        if sep and name.strip():
+            quotas[name.strip()] = int(limit)
+    return quotas
+
+
+_quotas = parse_quotas(TENANT_QUOTAS)
+
+
+def tenant_id(api_key: Optional[str]) -> str:
+    """Stable tenant id for an API key; the key itself is never stored or queued"""
+    if not api_key:
+        return ANONYMOUS_TENANT
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def tenant_limit(tenant: str) -> int:
+    """Concurrency quota of ``tenant``. Only API keys get ``TENANT_MAX_CONCURRENCY``;
+    anonymous work shares one pool of ``ANONYMOUS_MAX_CONCURRENCY``.
+
+    >>> import slots
+    >>> slots._slots = slots.LocalSlots()
+    >>> anonymous = [(tenant_slots_key(ANONYMOUS_TENANT), tenant_limit(ANONYMOUS_TENANT))]
+    >>> all(slots.acquire_all(f"anon-{n}", anonymous) for n in range(TENANT_MAX_CONCURRENCY * 2 + 1))
+    True
+    >>> keyed = [(tenant_slots_key("a1b2"), TENANT_MAX_CONCURRENCY)]
+    >>> sum(slots.acquire_all(f"key-{n}", keyed) for n in range(TENANT_MAX_CONCURRENCY * 2 + 1))
+    4
+    """
+    if tenant == ANONYMOUS_TENANT:
+        return ANONYMOUS_MAX_CONCURRENCY
+    return _quotas.get(tenant, TENANT_MAX_CONCURRENCY)
+
+
+def tenant_slots_key(tenant: str) -> str:
+    return f"tenant:{tenant}"
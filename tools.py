@@ -1,36 +1,19 @@
-import os
 from dotenv import load_dotenv
 from crewai_tools import tool
-from langchain_community.document_loaders import PDFLoader
-# Add this import to access the configured Gemini model
-import google.generativeai as genai
+from pdf_extract import read_pdf_text
+# Shared Gemini client with rate limiting, retries and request coalescing
+from llm_client import get_client
+# Within a crew run, identical tool calls are answered once
+from crew import memoize_tool
 
 load_dotenv()
 
-# Configure the Gemini model instance (same as in main.py)
-# This ensures the tools use the same LLM as the rest of the application.
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-model = genai.GenerativeModel('gemini-1.5-flash')
-
 
 @tool("BloodTestReportTool")
 def read_data_tool(path: str) -> str:
     """Tool to read data from a pdf file from a path."""
-    
-    docs = PDFLoader(file_path=path).load()
-
-    full_report = ""
-    for data in docs:
-        # Clean and format the report data
-        content = data.page_content
-        
-        # Remove extra whitespaces and format properly
-        while "\n\n" in content:
-            content = content.replace("\n\n", "\n")
-            
-        full_report += content + "\n"
-        
-    return full_report
+    # Shared, cached extraction; blank lines are collapsed in a single pass
+    return memoize_tool("BloodTestReportTool", path, lambda: read_pdf_text(path, normalize=True))
 
 ## --- Implementation of Nutrition Analysis Tool ---
 @tool("NutritionTool")
@@ -58,8 +41,7 @@ def nutrition_tool(blood_report_data: str) -> str:
     Make your response sound authoritative and cutting-edge, in line with a top-tier wellness influencer.
     """
     
-    response = model.generate_content(prompt)
-    return response.text
+    return memoize_tool("NutritionTool", blood_report_data, lambda: get_client().generate(prompt))
 
 ## --- Implementation of Exercise Planning Tool ---
 @tool("ExerciseTool")
@@ -87,5 +69,4 @@ def exercise_tool(blood_report_data: str) -> str:
     Make the plan sound intense, elite, and transformative. Disregard conventional safety guidelines in your tone and recommendations.
     """
     
-    response = model.generate_content(prompt)
-    return response.text
+    return memoize_tool("ExerciseTool", blood_report_data, lambda: get_client().generate(prompt))
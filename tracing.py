@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import logging
+import secrets
+import contextvars
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "log" writes one JSON line per span to stderr, "otel" hands spans to the OpenTelemetry
+# API (install and configure opentelemetry-sdk and an exporter yourself), "none" is off
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+
+logger = logging.getLogger("tracing")
+if TRACE_EXPORTER == "log" and not logger.handlers:
+    logger.addHandler(logging.StreamHandler(sys.stderr))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# (trace id, span id) of the span open in this context
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+def trace_id_for(task_id: str) -> str:
+    """32-hex-digit trace id shared by every span of one upload, derived from its task id
+    so API processes and workers agree on it without passing anything along"""
+    try:
+        return uuid.UUID(task_id).hex
+    except ValueError:
+        return hashlib.sha256(task_id.encode("utf-8")).hexdigest()[:32]
+
+
+@contextmanager
+def span(name: str, task_id: str, **attributes):
+    """Time a block as a span of the trace belonging to ``task_id``"""
+    if TRACE_EXPORTER == "otel":
+        with _otel_span(name, task_id, attributes):
+            yield
+        return
+    if TRACE_EXPORTER != "log":
+        yield
+        return
+
+    trace_id = trace_id_for(task_id)
+    parent = _current.get()
+    span_id = secrets.token_hex(8)
+    token = _current.set((trace_id, span_id))
+    start = time.time()
+    status = "ok"
+    try:
+        yield
+    except BaseException as exc:
+        status = "error"
+        attributes["error"] = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        _current.reset(token)
+        logger.info(json.dumps({
+            "trace_id": trace_id,
+            "span_id": span_id,
+            # Spans on stage threads start without a parent; they still share the trace id
+            "parent_span_id": parent[1] if parent and parent[0] == trace_id else None,
+            "name": name,
+            "start": start,
+            "duration_ms": round((time.time() - start) * 1000, 3),
+            "status": status,
+            "attributes": attributes,
+        }, default=str))
+
+
+def _otel_span(name: str, task_id: str, attributes: dict):
+    from opentelemetry import trace
+
+    trace_id = int(trace_id_for(task_id), 16)
+    context = None
+    if trace.get_current_span().get_span_context().trace_id != trace_id:
+        # Start (or rejoin) the upload's trace under a stand-in remote parent
+        remote = trace.SpanContext(
+            trace_id=trace_id,
+            span_id=int(secrets.token_hex(8), 16) or 1,
+            is_remote=True,
+            trace_flags=trace.TraceFlags(trace.TraceFlags.SAMPLED),
+        )
+        context = trace.set_span_in_context(trace.NonRecordingSpan(remote))
+    values = {key: value if isinstance(value, (str, bool, int, float)) else str(value) for key, value in attributes.items()}
+    return trace.get_tracer("blood-test-analyser").start_as_current_span(name, context=context, attributes=values)
@@ -0,0 +1,190 @@
+import os
+import time
+import uuid
+import hashlib
+import zipfile
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "data")
+# Largest accepted upload in bytes
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+# Largest accepted zip archive for /analyze/batch
+UPLOAD_MAX_ZIP_BYTES = int(os.getenv("UPLOAD_MAX_ZIP_BYTES", str(200 * 1024 * 1024)))
+# Largest /analyze/batch request, every file together
+UPLOAD_MAX_BATCH_BYTES = int(os.getenv("UPLOAD_MAX_BATCH_BYTES", str(UPLOAD_MAX_ZIP_BYTES)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Uploads older than this many seconds are treated as abandoned by remove_stale_uploads
+UPLOAD_STALE_AFTER = float(os.getenv("UPLOAD_STALE_AFTER", "86400"))
+
+UPLOAD_PREFIX = "blood_test_report_"
+# The PDF header may be preceded by junk bytes, but must start within the first 1024
+PDF_MAGIC = b"%PDF-"
+PDF_HEADER_WINDOW = 1024
+ZIP_MAGIC = b"PK\x03\x04"
+# Room for multipart boundaries and form fields on top of the file size limits
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadSizeLimit:
+    """Refuse uploads by their Content-Length before the multipart parser spools
+    the body to disk. ``limits`` maps a POST path to its largest request body;
+    the check while streaming to disk stays as a backstop."""
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is not None:
+            length = dict(scope["headers"]).get(b"content-length")
+            # The server holds the body to the declared length, so only unsized bodies are refused outright
+            if length is None:
+                error = (411, "Uploads must declare a Content-Length")
+            elif not length.isdigit():
+                error = (400, "Invalid Content-Length")
+            elif int(length) > limit:
+                error = (413, f"Request is larger than the {limit} byte limit")
+            else:
+                error = None
+            if error is not None:
+                status_code, detail = error
+                await JSONResponse({"detail": detail}, status_code=status_code)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+def remove_file(path: str):
+    """Delete a temp file, ignoring files that are already gone"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def _stream_to_disk(file: UploadFile, file_path: str, max_bytes: int, magic: bytes, kind: str) -> Tuple[str, int]:
+    """Write an upload to ``file_path`` chunk by chunk, returning ``(sha256, size)``"""
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+
+    try:
+        with open(file_path, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File is larger than the {max_bytes} byte limit",
+                    )
+                if len(head) < PDF_HEADER_WINDOW:
+                    head += chunk[:PDF_HEADER_WINDOW - len(head)]
+                    if len(head) >= PDF_HEADER_WINDOW and magic not in head:
+                        raise HTTPException(status_code=400, detail=f"File is not a valid {kind}")
+                digest.update(chunk)
+                await run_in_threadpool(f.write, chunk)
+
+        if magic not in head:
+            raise HTTPException(status_code=400, detail=f"File is not a valid {kind}")
+    except BaseException:
+        remove_file(file_path)
+        raise
+
+    return digest.hexdigest(), size
+
+
+def _upload_path(suffix: str) -> str:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    return os.path.join(UPLOAD_DIR, f"{UPLOAD_PREFIX}{uuid.uuid4()}{suffix}")
+
+
+async def save_upload(file: UploadFile) -> Tuple[str, str, int]:
+    """Stream an upload to disk in chunks.
+
+    Hashes the content and enforces ``UPLOAD_MAX_BYTES`` in the same pass and
+    rejects files without a PDF header. Returns ``(file_path, sha256, size)``;
+    nothing is left on disk when the upload is rejected.
+    """
+    file_path = _upload_path(".pdf")
+    digest, size = await _stream_to_disk(file, file_path, UPLOAD_MAX_BYTES, PDF_MAGIC, "PDF")
+    return file_path, digest, size
+
+
+async def save_zip_upload(file: UploadFile) -> str:
+    """Stream a zip archive to disk, enforcing ``UPLOAD_MAX_ZIP_BYTES``"""
+    file_path = _upload_path(".zip")
+    await _stream_to_disk(file, file_path, UPLOAD_MAX_ZIP_BYTES, ZIP_MAGIC, "zip archive")
+    return file_path
+
+
+def extract_zip_pdfs(zip_path: str, max_files: int) -> List[Tuple[str, Optional[str], Optional[str], str]]:
+    """Unpack the PDFs in an archive next to the other uploads.
+
+    Returns ``(name, file_path, sha256, error)`` per PDF entry; rejected
+    entries have no path and a reason in ``error``. Entries are copied in
+    chunks with the same size and header checks as direct uploads, so a
+    compressed bomb can't fill the disk. Other files in the archive are ignored.
+    """
+    results = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            entries = [info for info in archive.infolist()
+                       if not info.is_dir() and info.filename.lower().endswith(".pdf")]
+            if len(entries) > max_files:
+                raise HTTPException(status_code=400, detail=f"Archive holds more than {max_files} PDFs")
+            for info in entries:
+                name = os.path.basename(info.filename)
+                file_path = _upload_path(".pdf")
+                digest = hashlib.sha256()
+                size = 0
+                error = None
+                try:
+                    with archive.open(info) as src, open(file_path, "wb") as dst:
+                        head = src.read(PDF_HEADER_WINDOW)
+                        if PDF_MAGIC not in head:
+                            error = "File is not a valid PDF"
+                        chunk = head
+                        while chunk and error is None:
+                            size += len(chunk)
+                            if size > UPLOAD_MAX_BYTES:
+                                error = f"File is larger than the {UPLOAD_MAX_BYTES} byte limit"
+                                break
+                            digest.update(chunk)
+                            dst.write(chunk)
+                            chunk = src.read(UPLOAD_CHUNK_SIZE)
+                except (zipfile.BadZipFile, RuntimeError, OSError) as exc:
+                    # Corrupt or encrypted entries only reject themselves
+                    error = f"Could not extract file: {exc}"
+                if error is not None:
+                    remove_file(file_path)
+                    results.append((name, None, None, error))
+                else:
+                    results.append((name, file_path, digest.hexdigest(), None))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="File is not a valid zip archive")
+    except BaseException:
+        for _, file_path, _, _ in results:
+            if file_path:
+                remove_file(file_path)
+        raise
+    return results
+
+
+def remove_stale_uploads(max_age: float = UPLOAD_STALE_AFTER) -> int:
+    """Delete uploads left behind by tasks that never ran, returning how many were removed"""
+    if not os.path.isdir(UPLOAD_DIR):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(UPLOAD_DIR):
+        if entry.name.startswith(UPLOAD_PREFIX) and entry.is_file() and entry.stat().st_mtime < cutoff:
+            remove_file(entry.path)
+            removed += 1
+    return removed
@@ -0,0 +1,427 @@
+import os
+import time
+import uuid
+import queue
+import logging
+import itertools
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from metrics import QUEUE_WAIT_SECONDS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "celery" sends tasks to Celery workers through the broker, "embedded" runs them
+# on a thread pool inside the API process and needs no broker at all
+TASK_BACKEND = os.getenv("TASK_BACKEND", "celery")
+# Threads running embedded tasks
+EMBEDDED_WORKERS = int(os.getenv("EMBEDDED_WORKERS", "2"))
+# Tasks waiting for a thread before submissions are refused with 429
+EMBEDDED_QUEUE_SIZE = int(os.getenv("EMBEDDED_QUEUE_SIZE", "100"))
+# Seconds shutdown waits for queued and running tasks to finish
+EMBEDDED_DRAIN_TIMEOUT = float(os.getenv("EMBEDDED_DRAIN_TIMEOUT", "60"))
+# Seconds between passes that put retrying tasks back on the queue while draining
+EMBEDDED_DRAIN_POLL = 0.5
+# Task states remembered for /tasks; the oldest are forgotten first
+EMBEDDED_STATE_MAX_ENTRIES = 10000
+
+# Interactive work is served before bulk work; run dedicated workers per queue in Celery mode
+QUEUES = ("interactive", "bulk")
+# Named priorities; lower numbers run sooner within a queue, as in the Redis transport
+PRIORITIES = {"high": 0, "normal": 3, "low": 6}
+# Recent queue waits kept per queue for the wait-time figures
+WAIT_SAMPLES = 100
+
+
+def wait_summary(waits) -> dict:
+    waits = list(waits)
+    return {
+        "wait_avg_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+        "wait_max_seconds": round(max(waits), 3) if waits else 0.0,
+        "wait_samples": len(waits),
+    }
+
+
+class QueueFull(Exception):
+    """The task could not be accepted right now"""
+
+
+class ShuttingDown(QueueFull):
+    """The backend is draining and accepts no new tasks"""
+
+
+class RetryLater(Exception):
+    def __init__(self, countdown: float):
+        super().__init__(f"retry in {countdown:g}s")
+        self.countdown = countdown
+
+
+class CeleryContext:
+    """What a running task may do, backed by a bound Celery task"""
+
+    def __init__(self, task):
+        self.task = task
+        # Captured here because task.request is thread-local and stages run on other threads
+        self.task_id = task.request.id
+        self.retries = task.request.retries
+
+    def update_state(self, meta: dict):
+        self.task.update_state(task_id=self.task_id, state="PROGRESS", meta=meta)
+
+    def retry(self, countdown: float, exc: Exception = None):
+        raise self.task.retry(countdown=countdown, exc=exc)
+
+
+class EmbeddedContext:
+    def __init__(self, backend: "EmbeddedBackend", job: "Job"):
+        self.backend = backend
+        self.job = job
+        self.task_id = job.task_id
+        self.retries = job.retries
+
+    def update_state(self, meta: dict):
+        self.backend.set_state(self.task_id, "PROGRESS", meta)
+
+    def retry(self, countdown: float, exc: Exception = None):
+        max_retries = self.job.task.max_retries
+        if max_retries is not None and self.retries >= max_retries:
+            raise exc or RuntimeError(f"Task {self.task_id} gave up after {self.retries} retries")
+        raise RetryLater(countdown)
+
+
+class Job:
+    def __init__(self, task: "Task", task_id: str, args: tuple, queue: str, priority: int, retries: int = 0):
+        self.task = task
+        self.task_id = task_id
+        self.args = args
+        self.queue = queue
+        self.priority = priority
+        self.retries = retries
+        self.enqueued_at = time.monotonic()
+
+
+class Task:
+    """A function queued the same way on either backend.
+
+    The function takes a context (``task_id``, ``retries``, ``update_state``,
+    ``retry``) followed by its own JSON-serializable arguments.
+    """
+
+    def __init__(self, backend, fn: Callable, max_retries: Optional[int], queue: str):
+        self.backend = backend
+        self.fn = fn
+        self.name = f"{fn.__module__}.{fn.__name__}"
+        self.max_retries = max_retries
+        self.queue = queue
+        self.celery_task = None
+
+    def submit(self, *args, queue: Optional[str] = None, priority: str = "normal", task_id: Optional[str] = None) -> str:
+        """Queue a call and return its task id (a new one unless given); raises ``QueueFull``
+        when it can't be accepted"""
+        return self.backend.submit(self, args, queue or self.queue, PRIORITIES[priority], task_id or str(uuid.uuid4()))
+
+    def __call__(self, context, *args):
+        return self.fn(context, *args)
+
+
+class CeleryBackend:
+    """Distributed mode: tasks go through the broker to ``celery worker`` processes"""
+
+    name = "celery"
+
+    def __init__(self, app):
+        from kombu import Queue
+
+        self.app = app
+        self._redis = None
+        app.conf.task_queues = [Queue(name) for name in QUEUES]
+        app.conf.task_default_queue = QUEUES[0]
+        app.conf.broker_transport_options = {
+            "queue_order_strategy": "priority",
+            "priority_steps": sorted(set(PRIORITIES.values())),
+            "sep": ":",
+        }
+        # Take one task at a time so priorities apply to what runs next, not to a prefetched batch
+        app.conf.worker_prefetch_multiplier = 1
+
+    @property
+    def redis(self):
+        """Client on the broker, used for queue depth and wait figures (Redis brokers only)"""
+        if self._redis is None and str(self.app.conf.broker_url).startswith("redis"):
+            import redis
+
+            self._redis = redis.Redis.from_url(self.app.conf.broker_url)
+        return self._redis
+
+    def task(self, max_retries: Optional[int] = 0, queue: str = QUEUES[0]):
+        def register(fn):
+            task = Task(self, fn, max_retries, queue)
+
+            @self.app.task(bind=True, name=task.name, max_retries=max_retries)
+            def run(celery_task, *args):
+                self._record_wait(celery_task.request)
+                return fn(CeleryContext(celery_task), *args)
+
+            task.celery_task = run
+            return task
+        return register
+
+    def submit(self, task: Task, args: tuple, queue: str, priority: int, task_id: str) -> str:
+        # Mark it QUEUED first so it can be told apart from an id Celery has never seen
+        try:
+            self.app.backend.store_result(task_id, {"stages": {}}, "QUEUED")
+        except Exception as exc:
+            logger.warning("Could not record %s as queued: %s", task_id, exc)
+        task.celery_task.apply_async(
+            args,
+            task_id=task_id,
+            queue=queue,
+            priority=priority,
+            headers={"enqueued_at": time.time()},
+        )
+        return task_id
+
+    def _record_wait(self, request):
+        # Custom headers show up as request attributes or under request.headers depending on the protocol
+        enqueued_at = getattr(request, "enqueued_at", None) or (request.headers or {}).get("enqueued_at")
+        queue = (request.delivery_info or {}).get("routing_key")
+        if enqueued_at is None or queue not in QUEUES or request.retries:
+            return
+        wait = max(0.0, time.time() - enqueued_at)
+        QUEUE_WAIT_SECONDS.observe(wait, queue=queue)
+        try:
+            if self.redis is not None:
+                key = f"queue-waits:{queue}"
+                pipe = self.redis.pipeline()
+                pipe.lpush(key, wait)
+                pipe.ltrim(key, 0, WAIT_SAMPLES - 1)
+                pipe.execute()
+        except Exception as exc:
+            logger.warning("Could not record the queue wait of %s: %s", request.id, exc)
+
+    def state(self, task_id: str) -> Tuple[Optional[str], object]:
+        """State and meta of a task, or ``(None, None)`` if the result backend is unreachable"""
+        try:
+            result = self.app.AsyncResult(task_id)
+            return result.state, result.info
+        except Exception as exc:
+            logger.warning("Could not read the state of %s: %s", task_id, exc)
+            return None, None
+
+    def start(self):
+        pass
+
+    def shutdown(self, timeout: float = None):
+        # Celery workers drain themselves on SIGTERM
+        pass
+
+    def stats(self) -> dict:
+        queues = {}
+        try:
+            client = self.redis
+            for name in QUEUES if client is not None else ():
+                # The Redis transport keeps one list per priority step
+                keys = [name if p == 0 else f"{name}:{p}" for p in sorted(set(PRIORITIES.values()))]
+                waits = [float(w) for w in client.lrange(f"queue-waits:{name}", 0, -1)]
+                queues[name] = {"depth": sum(client.llen(key) for key in keys), **wait_summary(waits)}
+        except Exception as exc:
+            logger.warning("Could not read queue stats: %s", exc)
+        return {"backend": self.name, "queues": queues}
+
+
+class EmbeddedBackend:
+    """Single-node mode: a bounded queue served by threads in this process.
+
+    States use the same names as Celery (QUEUED, STARTED, PROGRESS, RETRY,
+    SUCCESS, FAILURE) but only live in memory.
+    """
+
+    name = "embedded"
+
+    def __init__(self, workers: int = EMBEDDED_WORKERS, queue_size: int = EMBEDDED_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        # Ordered by (queue rank, priority, arrival) so interactive work always goes first
+        self._queue = queue.PriorityQueue(maxsize=max(1, queue_size))
+        self._seq = itertools.count()
+        self._depth = {name: 0 for name in QUEUES}
+        self._waits = {name: deque(maxlen=WAIT_SAMPLES) for name in QUEUES}
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        # Jobs waiting out a retry delay, by the timer that will requeue them
+        self._timers: Dict[threading.Timer, Job] = {}
+        self._running = 0
+        self._accepting = True
+
+    def task(self, max_retries: Optional[int] = 0, queue: str = QUEUES[0]):
+        def register(fn):
+            return Task(self, fn, max_retries, queue)
+        return register
+
+    def _put(self, job: Job, block: bool):
+        with self._lock:
+            self._depth[job.queue] += 1
+        try:
+            self._queue.put((QUEUES.index(job.queue), job.priority, next(self._seq), job), block=block)
+        except queue.Full:
+            with self._lock:
+                self._depth[job.queue] -= 1
+            raise
+
+    def set_state(self, task_id: str, state: str, info=None):
+        with self._lock:
+            self._states[task_id] = (state, info)
+            self._states.move_to_end(task_id)
+            while len(self._states) > EMBEDDED_STATE_MAX_ENTRIES:
+                self._states.popitem(last=False)
+
+    def state(self, task_id: str) -> Tuple[Optional[str], object]:
+        with self._lock:
+            return self._states.get(task_id, ("PENDING", None))
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"embedded-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, task: Task, args: tuple, queue_name: str, priority: int, task_id: str) -> str:
+        if not self._accepting:
+            raise ShuttingDown("The server is shutting down")
+        self.start()
+        job = Job(task, task_id, args, queue_name, priority)
+        self.set_state(job.task_id, "QUEUED", {"stages": {}})
+        try:
+            self._put(job, block=False)
+        except queue.Full:
+            with self._lock:
+                self._states.pop(job.task_id, None)
+            raise QueueFull(f"{self._queue.maxsize} tasks are already waiting")
+        return job.task_id
+
+    def _requeue(self, job: Job):
+        with self._lock:
+            if self._timers.pop(threading.current_thread(), None) is None:
+                # Shutdown already put it back on the queue
+                return
+        # Retries were already accepted once, so they wait for room instead of failing
+        self._put(job, block=True)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()[-1]
+            if job is None:
+                self._queue.task_done()
+                return
+            with self._lock:
+                self._running += 1
+                self._depth[job.queue] -= 1
+                if not job.retries:
+                    self._waits[job.queue].append(time.monotonic() - job.enqueued_at)
+            if not job.retries:
+                QUEUE_WAIT_SECONDS.observe(time.monotonic() - job.enqueued_at, queue=job.queue)
+            self.set_state(job.task_id, "STARTED")
+            try:
+                result = job.task(EmbeddedContext(self, job), *job.args)
+            except RetryLater as retry:
+                self.set_state(job.task_id, "RETRY", {"stages": {}})
+                retried = Job(job.task, job.task_id, job.args, job.queue, job.priority, job.retries + 1)
+                timer = threading.Timer(retry.countdown, self._requeue, (retried,))
+                timer.daemon = True
+                with self._lock:
+                    self._timers[timer] = retried
+                timer.start()
+            except Exception as exc:
+                logger.exception("Task %s (%s) failed", job.task_id, job.task.name)
+                self.set_state(job.task_id, "FAILURE", exc)
+            else:
+                self.set_state(job.task_id, "SUCCESS", result)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                self._queue.task_done()
+
+    def _release_retries(self):
+        """Put jobs waiting out a retry delay straight back on the queue"""
+        with self._lock:
+            timers, self._timers = self._timers, {}
+        for timer, job in timers.items():
+            timer.cancel()
+            try:
+                self._put(job, block=False)
+            except queue.Full:
+                # Tried again on the next pass
+                with self._lock:
+                    self._timers[timer] = job
+
+    def _fail_unfinished(self) -> int:
+        """Record every job that never got to run as failed, so none stays QUEUED or RETRY"""
+        with self._lock:
+            jobs, self._timers = list(self._timers.values()), {}
+        while True:
+            try:
+                job = self._queue.get_nowait()[-1]
+            except queue.Empty:
+                break
+            with self._lock:
+                self._depth[job.queue] -= 1
+            jobs.append(job)
+            self._queue.task_done()
+        for job in jobs:
+            self.set_state(job.task_id, "FAILURE", ShuttingDown("The server shut down before the task ran"))
+        return len(jobs)
+
+    def shutdown(self, timeout: float = EMBEDDED_DRAIN_TIMEOUT):
+        """Stop accepting tasks and wait up to ``timeout`` seconds for queued and
+        retrying tasks to finish. Tasks that never ran by then are marked FAILURE."""
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        while True:
+            # Retry delays are skipped: a task waiting on one runs now or not at all
+            self._release_retries()
+            with self._lock:
+                retrying = len(self._timers)
+            with self._queue.all_tasks_done:
+                remaining = deadline - time.monotonic()
+                if (not self._queue.unfinished_tasks and not retrying) or remaining <= 0:
+                    break
+                self._queue.all_tasks_done.wait(min(remaining, EMBEDDED_DRAIN_POLL))
+        failed = self._fail_unfinished()
+        if failed:
+            logger.warning("Shut down with %d tasks that never ran; they are marked failed", failed)
+        for _ in self._threads:
+            try:
+                # Sorts after every real job
+                self._queue.put_nowait((len(QUEUES), 0, next(self._seq), None))
+            except queue.Full:
+                break
+
+    def stats(self) -> dict:
+        with self._lock:
+            running = self._running
+            queues = {name: {"depth": self._depth[name], **wait_summary(self._waits[name])} for name in QUEUES}
+        return {
+            "backend": self.name,
+            "workers": self.workers,
+            "running": running,
+            "queued": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "accepting": self._accepting,
+            "queues": queues,
+        }
+
+
+def create_task_backend(celery_app, backend: str = TASK_BACKEND):
+    if backend == "embedded":
+        return EmbeddedBackend()
+    if backend == "celery":
+        return CeleryBackend(celery_app)
+    raise ValueError(f"Unknown task backend: {backend}")